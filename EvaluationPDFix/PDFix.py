@@ -1,51 +1,206 @@
-from metadata import get_metadata
-from createTaggedPDF import initAnalyzer, create_rml, create_tagged_pdf
+from metadata import get_metadata, index_manifest
+from createTaggedPDF import initAnalyzer, create_rml_file, read_rml, create_tagged_pdf, create_tagged_pdf_parallel
+from analyzer import get_analyzer, born_digital_config, default_workers
+from manifest import collect_inputs, load as load_manifest
+import cache
+import tracing
 
 import sys
 import os
+import time
+import tempfile
 import argparse
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
 
 def argumentParse():
     parser = argparse.ArgumentParser(description='PDFix repairs a give PDF document to tagged accessihle PDF.')
 
     # Add a required argument
-    parser.add_argument('-i', '--input', type=str, help='Path to input pdf file.')
-    parser.add_argument('-o', '--output', type=str, help='Path to output pdf file.')
+    parser.add_argument('-i', '--input', type=str, help='Path to input pdf file. In batch mode a directory, glob or manifest file.')
+    parser.add_argument('-o', '--output', type=str, help='Path to output pdf file. In batch mode the output directory.')
 
     # optional arguments
     parser.add_argument('-f', '--force', action='store_true',
                         help='Force mode', default=False)
+    parser.add_argument('-b', '--batch', action='store_true',
+                        help='Batch mode, always runs in force mode', default=False)
+    parser.add_argument('-w', '--workers', type=int,
+                        help='Number of worker processes in batch mode, by default as many as fit in the available memory', default=None)
+    parser.add_argument('--pdf-dir', type=str,
+                        help='Directory with the pdf files of a CSV manifest', default=None)
+    parser.add_argument('-p', '--pages-per-part', type=int,
+                        help='Render page ranges of this size in parallel processes and merge them (not in batch mode)', default=0)
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Re-analyze the files instead of reading cached analysis results', default=False)
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='Remove all cached analysis results before processing', default=False)
+    parser.add_argument('--trace', type=str,
+                        help='Append the time, CPU time and peak memory of every stage to this JSON lines file', default=None)
+    parser.add_argument('--chrome-trace', type=str,
+                        help='Append the stages as Chrome trace events to this file (chrome://tracing, Perfetto)', default=None)
 
     # Parse the command-line arguments
     args = parser.parse_args()
 
     # Access the value of the required argument
-    return args.input, args.output, args.force
+    return args
+
+
+def count_pages(doc, counter):
+    """Passes the analyzed pages through while counting them."""
+
+    for page in doc:
+        counter['pages'] += 1
+        yield page
+
+
+def process_file(input_path, output_path, force_mode, use_cache=True, pages_per_part=0, workers=None, manifest=None):
+    """Converts one pdf file to tagged PDF and returns the number of pages.
+    With pages_per_part the document is rendered in page ranges by a pool of workers.
+    Metadata from the manifest takes precedence over the metadata in the file."""
+
+    counter = {'pages': 0}
+
+    with tracing.stage("document", document=input_path) as span:
+        # Get the required metadata from the file
+        with tracing.stage("metadata"):
+            metadata = get_metadata(input_path, force_mode, manifest)
+
+        # Initialize the PDF creator
+        document = count_pages(initAnalyzer(input_path, use_cache=use_cache), counter)
+
+        if pages_per_part:
+            create_tagged_pdf_parallel(document, metadata, output_path, pages_per_part, workers)
+            span['pages'] = counter['pages']
+            return counter['pages']
+
+        # Stream the RML to a temporary file while the pages are analyzed
+        filename = os.path.basename(output_path)
+        fd, rml_path = tempfile.mkstemp(suffix='.rml')
+        os.close(fd)
+
+        try:
+            create_rml_file(
+                doc=document,
+                metadata=metadata,
+                filename=filename,
+                rml_path=rml_path
+            )
+
+            # Create tagged PDF
+            create_tagged_pdf(read_rml(rml_path), output_path)
+
+        finally:
+            os.remove(rml_path)
+
+        span['pages'] = counter['pages']
+
+    return counter['pages']
+
+
+def init_worker():
+    """Loads the analyzer once per worker process, before the first file arrives.
+    Most documents are born-digital, the OCR analyzer is loaded with the first scanned one."""
 
+    try:
+        get_analyzer(born_digital_config())
+    except Exception as e:
+        print(f"Error loading the analyzer in worker {os.getpid()}: {type(e).__name__}: {str(e)}", file=sys.stderr, flush=True)
+        raise
 
-def process_file(input_path, output_path, force_mode):
-    # Get the required metadata from the file
-    metadata = get_metadata(input_path, force_mode)
 
-    # Initialize the PDF creator
-    document = initAnalyzer(input_path)
+def process_job(job):
+    """Runs process_file in a worker, so a failing file does not stop the batch."""
 
-    # Create the RML string
-    filename = os.path.basename(output_path)
-    rml = create_rml(
-        doc=document,
-        metadata=metadata,
-        filename=filename
-    )
+    input_path, output_path, use_cache, manifest = job
+    start = time.perf_counter()
 
-    # Create tagged PDF
-    create_tagged_pdf(rml, output_path)
+    try:
+        pages = process_file(input_path, output_path, force_mode=True, use_cache=use_cache, manifest=manifest)
+        error = None
 
+    except Exception as e:
+        pages = 0
+        error = f"{type(e).__name__}: {str(e)}"
+
+    return input_path, pages, error, time.perf_counter() - start
+
+
+def process_batch(input_paths, output_dir, workers, use_cache=True, manifest=None):
+    """Converts all input files with a pool of worker processes.
+    manifest maps a file name without .pdf to its manifest metadata.
+    Returns the list of files that failed. Exits when the workers cannot load the analyzer.
+    A worker that dies (e.g. killed for running out of memory) breaks the pool, the files
+    that were not converted by then are reported as failed."""
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = manifest or {}
+    jobs = [(path, os.path.join(output_dir, os.path.basename(path)), use_cache,
+             manifest.get(os.path.splitext(os.path.basename(path))[0])) for path in input_paths]
+
+    failed = []
+    total_pages = 0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers or default_workers(), initializer=init_worker) as pool:
+        # Start one worker first, a failing initializer breaks the pool before any file is processed
+        try:
+            pool.submit(os.getpid).result()
+        except BrokenProcessPool:
+            sys.exit("Error: the worker processes could not load the analyzer, see the error above")
+
+        futures = {pool.submit(process_job, job): job[0] for job in jobs}
+        broken = False
+
+        for i, future in enumerate(as_completed(futures), 1):
+            try:
+                input_path, pages, error, duration = future.result()
+            except BrokenProcessPool:
+                input_path, pages, error, duration = futures[future], 0, "worker process died", 0.0
+                broken = True
+
+            if error is None:
+                total_pages += pages
+                print(f"[{i}/{len(jobs)}] {input_path}: {pages} pages in {duration:.1f}s")
+            else:
+                failed.append(input_path)
+                print(f"[{i}/{len(jobs)}] {input_path} failed: {error}")
+
+    if broken:
+        print("A worker process died, e.g. killed for running out of memory. "
+              "Rerun the failed files with fewer workers (-w)", file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    converted = len(jobs) - len(failed)
+
+    print(f"Converted {converted}/{len(jobs)} documents ({total_pages} pages) in {elapsed:.1f}s")
+    if elapsed > 0:
+        print(f"Throughput: {converted / elapsed:.2f} documents/s, {total_pages / elapsed:.2f} pages/s")
+
+    return failed
 
 
 if __name__ == '__main__':
-    input_path, output_path, force_mode = argumentParse()
+    args = argumentParse()
+
+    if args.clear_cache:
+        cache.clear()
+
+    # Worker processes inherit the trace files through the environment
+    if args.trace or args.chrome_trace:
+        tracing.enable(args.trace, args.chrome_trace)
+
+    if args.batch:
+        input_paths = collect_inputs(args.input, args.pdf_dir)
+
+        # The metadata of a CSV manifest is indexed by identifier, which is also the file name
+        manifest = index_manifest(load_manifest(args.input).to_dict('records')) if args.input.lower().endswith('.csv') else None
+
+        failed = process_batch(input_paths, args.output, args.workers, not args.no_cache, manifest)
+        sys.exit(1 if failed else 0)
 
     # Process file
-    process_file(input_path, output_path, force_mode)
+    process_file(args.input, args.output, args.force, not args.no_cache, args.pages_per_part, args.workers)
@@ -2,152 +2,52 @@ import sys
 import os
 import argparse
 import timeit
-import datetime
 import io
-import subprocess
 import contextlib
 import sys
 
-import deepdoctection as dd
-import pandas as pd
-import numpy as np
-
-from pypdf import PdfReader
 from bs4 import BeautifulSoup
-from pathlib import Path
+from xml.sax.saxutils import escape, quoteattr
 from contextlib import redirect_stdout
+from analyzer import analyze, triage
+from metadata import get_record, manifest_values
+from layout_table import LayoutTable
+import manifest
+from download import fetch, candidate_urls
+import tracing
 
 def load_dataframe(file_path):
-    df = pd.read_csv(file_path)
+    # Memory mapped read of the cached manifest, only the beslisnota rows
+    df = manifest.load(file_path, dc_type='2e-b')
 
     print("Dataframed loaded...")
-    return df[df["dc_type"] == '2e-b']
+    return df
     
 
 def download_pdf(df_row, file_path):
-    url = "https://doi.wooverheid.nl/?doi="
     doi = df_row['dc_identifier']
-    Turl = url + doi
 
-    # Download pdf
-    command = ["wget", "-q", "--output-document", file_path, Turl]
-    subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # Download pdf, see download.py for whole manifests
+    fetch(candidate_urls(df_row, doi), file_path)
     
     return print(f"File downloaded to {file_path}")
 
 
 def set_metadata(df_row, file_path):
-    # Set metadata with values from dataframe
-    metadata = {
-    "title": None,
-    "author": None,
-    "subject": None,
-    "producer": "PDFix",
-    "creator": None,
-    "creation_date": None,
-    "mod_date": None,
-    }
-    try: 
-        if df_row["dc_title"] != np.NaN:
-            metadata["title"] = df_row["dc_title"]
-
-        if df_row["dc_publisher_name"] != np.NaN:
-            metadata["author"] = df_row["dc_publisher_name"]
-
-        if df_row["dc_description"] != np.NaN:
-            metadata["subject"] = df_row["dc_description"]
-
-        if df_row["foi_publishedDate"] != np.NaN:
-            metadata["creation_date"] = df_row["foi_publishedDate"]
-
-    except Exception as e:
-        print("Error set metadata: " + str(e))
-
-
-    # Fill metadata with values from original PDF
-    try:
-        reader = PdfReader(file_path)
-
-        if metadata['title'] == None:
-            if hasattr(reader.metadata, 'title') == False:
-                metadata['title'] = "Undefined"
-
-        if metadata['author'] == None:
-            if hasattr(reader.metadata, 'author') == False:
-                metadata['author'] = "Undefined"
-
-        if metadata['subject'] == None:
-            if hasattr(reader.metadata, 'description') == False:
-                metadata['subject'] = "Undefined"
-
-        if metadata['creator'] == None:
-            if hasattr(reader.metadata, 'creator') == False:
-                metadata['creator'] = "Undefined"
-
-        if metadata['producer'] == None:
-            if hasattr(reader.metadata, 'producer') == False:
-                metadata['producer'] = "Undefined"
-
-        if metadata['creation_date'] == None:
-            if hasattr(reader.metadata, 'creation_date') == False:
-                metadata['creation_date'] = "Undefined"
-
-        if metadata['mod_date'] == None:
-            metadata['mod_date'] = datetime.datetime.now()
-
-    except Exception as e:
-        print("Error fill metadata: " + str(e))
+    """Returns the metadata of the dataframe row, filled with the metadata of the PDF.
+    If no metadata is found 'Undefined' is used."""
+    with tracing.stage("metadata", document=file_path):
+        metadata = get_record(file_path, manifest_values(df_row))
+    metadata["producer"] = "PDFix"
 
     print("Metadata set...")
     return metadata
 
 
-    """Fill missing metadata with metadata from pdf. 
-    If no metadata to fill is found 'Undefined' is used."""
-
-    try:
-        reader = PdfReader(file_path)
-
-        if metadata['title'] == None:
-            if hasattr(reader.metadata, 'title') == False:
-                metadata['title'] = "Undefined"
-
-        if metadata['author'] == None:
-            if hasattr(reader.metadata, 'author') == False:
-                metadata['author'] = "Undefined"
-
-        if metadata['subject'] == None:
-            if hasattr(reader.metadata, 'description') == False:
-                metadata['subject'] = "Undefined"
-
-        if metadata['creator'] == None:
-            if hasattr(reader.metadata, 'creator') == False:
-                metadata['creator'] = "Undefined"
-
-        if metadata['producer'] == None:
-            if hasattr(reader.metadata, 'producer') == False:
-                metadata['producer'] = "Undefined"
-
-        if metadata['creation_date'] == None:
-            if hasattr(reader.metadata, 'creation_date') == False:
-                metadata['creation_date'] = "Undefined"
-
-        if metadata['mod_date'] == None:
-            metadata['mod_date'] = datetime.datetime.now()
-
-    except Exception as e:
-        print("Error: " + str(e))
-
-    return metadata
-
-
-def init_analyzer(pdf_path):
+def init_analyzer(pdf_path, config=None, use_cache=True):
     """Initialize the DeepDoctection analyzer."""
     try:
-        analyzer = dd.get_dd_analyzer(config_overwrite=["LANGUAGE='nld'"])
-        path = Path.cwd() / pdf_path
-        df = analyzer.analyze(path=path)
-        doc = iter(df)
+        doc = analyze(pdf_path, triage(pdf_path, config), use_cache)
     
     except Exception as e:
         print(f"Error init_analyzer: {str(e)}")
@@ -254,11 +154,69 @@ def build_html(doc, metadata):
     return html.prettify()
 
 
-def save_html(html, output_path):
-    with open(output_path, "w") as file:
-        file.write(html)
+# Layout categories and the tag they are written as
+HTML_TAGS = {"text": "p", "title": "H2", "list": "p"}
+
+
+def write_html(doc, metadata, out, pretty=True):
+    """Writes the accessible HTML of an analyzed PDF document to a file handle.
+    Elements are written as the layouts are visited in reading order, without building a tree.
+    With pretty the output matches build_html, otherwise it is written without indentation."""
+
+    def write(level, markup):
+        if pretty:
+            out.write(" " * level + markup + "\n")
+        else:
+            out.write(markup)
+
+    def write_element(level, tag, text):
+        # Like prettify, surrounding whitespace is dropped from text and empty text is left out
+        text = "" if text is None else str(text)
+        if pretty:
+            text = text.strip()
+
+        write(level, f"<{tag}>")
+        if text:
+            write(level + 1, escape(text))
+        write(level, f"</{tag}>")
+
+    def attribute(value):
+        return quoteattr("" if value is None else str(value))
+
+    write(0, '<?xml version="1.0" encoding="UTF-8"?>')
+    write(0, '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//NL" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">')
+    write(0, '<html lang="nl" xml:lang="nl" xmlns="http://www.w3.org/1999/xhtml">')
 
-    return print(f"File saved to {output_path}")   
+    # Add metadata
+    write(1, "<head>")
+    write_element(2, "title", metadata["title"])
+    write(2, '<meta charset="utf-8"/>')
+    write(2, '<meta content="width=device-width, initial-scale=1" name="viewport"/>')
+    for key, name in [("subject", "subject"), ("author", "author"), ("creator", "creator"), ("producer", "producer"),
+                      ("creation_date", "creation_date"), ("mod_date", "modification_date")]:
+        write(2, f'<meta content={attribute(metadata[key])} name="{name}"/>')
+    write(1, "</head>")
+
+    # Add title to body
+    write(1, "<body>")
+    write_element(2, "H1", metadata["title"])
+
+    for page in doc:
+        # Find the correct reading order
+        table = LayoutTable(page)
+
+        for y in table.order().tolist():
+            tag = HTML_TAGS.get(table.names[y])
+
+            if tag is None:
+                print(page.layouts[y].category_name)
+            else:
+                write_element(2, tag, page.layouts[y].text)
+
+    write(1, "</body>")
+    write(0, "</html>")
+
+    return print("HTML written...")
 
 
 if __name__ == '__main__':
@@ -278,15 +236,15 @@ if __name__ == '__main__':
     # Initialize the PDF analyzer
     document = init_analyzer(file_path)
 
-    # Create the HTML string
-    html = build_html(
-        doc=document,
-        metadata=metadata,
-    )
-
-    # Save HTML file
+    # Write the HTML file while the pages are analyzed, traced when PDFIX_TRACE is set
     output_path = 'outputHTML.html'
-    save_html(html, output_path)
+    with tracing.stage("html", document=file_path), open(output_path, "w", encoding="utf-8") as file:
+        write_html(
+            doc=document,
+            metadata=metadata,
+            out=file,
+        )
+    print(f"File saved to {output_path}")
 
     print(str(timeit.default_timer() - start) + "s")
 
@@ -0,0 +1,195 @@
+import deepdoctection as dd
+import cache
+import tracing
+import json
+import os
+import time
+
+from functools import lru_cache
+from pathlib import Path
+from pypdf import PdfReader
+
+
+DEFAULT_CONFIG = ["LANGUAGE='nld'"]
+
+# Born-digital documents: layout detection only, words and positions come from the PDF text layer
+BORN_DIGITAL_OPTIONS = ["USE_OCR=False", "USE_PDF_MINER=True"]
+
+# Scanned or mixed documents: OCR stays on, DeepDoctection skips it on pages PDFMiner found text on
+SCANNED_OPTIONS = ["USE_PDF_MINER=True"]
+
+# A page has a usable text layer with at least this many letters and digits ...
+MIN_TEXT_CHARS = 25
+# ... making up at least this share of its visible characters, broken font encodings give mostly symbols
+MIN_TEXT_RATIO = 0.5
+
+TRIAGE_LOG = cache.CACHE_DIR / "triage.jsonl"
+
+# Peak memory of a worker process with the layout, OCR and table models loaded
+WORKER_MEMORY_MB = 3000
+
+# One warm analyzer per distinct config_overwrite combination, kept for the life of the process
+_analyzers = {}
+
+
+def config_key(config=None):
+    """Returns the hashable registry key for a config_overwrite list."""
+
+    if config is None:
+        config = DEFAULT_CONFIG
+
+    return tuple(sorted(config))
+
+
+def get_analyzer(config=None):
+    """Returns the DeepDoctection analyzer for the given config_overwrite list.
+    The models are loaded on first use and reused for every following call."""
+
+    key = config_key(config)
+
+    if key not in _analyzers:
+        _analyzers[key] = tracing.instrument(dd.get_dd_analyzer(config_overwrite=list(key)))
+
+    return _analyzers[key]
+
+
+def available_memory_mb():
+    """Returns the available physical memory, or None where the platform does not report it."""
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_workers():
+    """As many worker processes as there are CPUs and as fit in the available memory with a loaded
+    analyzer each, at least one."""
+
+    workers = os.cpu_count() or 1
+    memory = available_memory_mb()
+    if memory is not None:
+        workers = min(workers, int(memory // WORKER_MEMORY_MB))
+    return max(workers, 1)
+
+
+def with_options(config, options):
+    """Returns config with the KEY=VALUE options added, replacing entries with the same keys."""
+
+    keys = {option.split("=", 1)[0] for option in options}
+    return [entry for entry in (config or DEFAULT_CONFIG) if entry.split("=", 1)[0] not in keys] + list(options)
+
+
+def born_digital_config(config=None):
+    return with_options(config, BORN_DIGITAL_OPTIONS)
+
+
+def scanned_config(config=None):
+    return with_options(config, SCANNED_OPTIONS)
+
+
+def usable_text(text):
+    """True when extracted page text looks like real text and not an empty or garbled layer."""
+
+    visible = sum(not c.isspace() for c in text)
+    alnum = sum(c.isalnum() for c in text)
+
+    return alnum >= MIN_TEXT_CHARS and alnum >= MIN_TEXT_RATIO * visible
+
+
+@lru_cache(maxsize=64)
+def _text_layer(pdf_path, mtime):
+    flags = []
+    for page in PdfReader(pdf_path).pages:
+        try:
+            flags.append(usable_text(page.extract_text() or ""))
+        except Exception:
+            flags.append(False)
+
+    return tuple(flags)
+
+
+def text_layer(pdf_path):
+    """Returns for every page of a PDF whether it has a usable text layer."""
+
+    pdf_path = os.path.abspath(pdf_path)
+    return list(_text_layer(pdf_path, os.path.getmtime(pdf_path)))
+
+
+def triage(pdf_path, config=None):
+    """Returns the config to analyze a PDF with. When every page has a usable text layer
+    OCR is switched off, otherwise pages with text still skip OCR through PDFMiner.
+    A config that sets USE_OCR itself is returned as is. The decision of every page is
+    appended to triage.jsonl in the cache directory."""
+
+    config = list(config or DEFAULT_CONFIG)
+    if any(entry.startswith("USE_OCR=") for entry in config):
+        return config
+
+    try:
+        with tracing.stage("triage", document=pdf_path):
+            pages = text_layer(pdf_path)
+    except Exception as e:
+        print(f"Error triage: {str(e)}")
+        pages = []
+
+    born_digital = bool(pages) and all(pages)
+    mode = "born-digital" if born_digital else "ocr"
+
+    print(f"Triage {os.path.basename(pdf_path)}: {sum(pages)}/{len(pages)} pages with a text layer, {mode}")
+
+    try:
+        cache.CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with open(TRIAGE_LOG, "a", encoding="utf-8") as log:
+            log.write(json.dumps({"path": os.path.abspath(pdf_path), "mode": mode,
+                                  "pages": ["text" if page else "ocr" for page in pages]}) + "\n")
+    except OSError as e:
+        print(f"Error triage log: {str(e)}")
+
+    return born_digital_config(config) if born_digital else scanned_config(config)
+
+
+def clear_analyzers():
+    """Drops all warm analyzers so their models can be garbage collected."""
+
+    _analyzers.clear()
+
+
+def analyze(pdf_path, config=None, use_cache=True, key=None):
+    """Yields the analyzed pages of a PDF file.
+    Pages of a PDF that was analyzed before with the same config are read from
+    the on-disk cache, otherwise the analyzer runs and the result is cached."""
+
+    path = Path.cwd() / pdf_path
+    if key is None:
+        key = cache.cache_key(path, config_key(config))
+
+    if use_cache:
+        pages = cache.load(key, path)
+        if pages is not None:
+            yield from pages
+            return
+
+    serialized = []
+    start = time.perf_counter()
+    pages = iter(get_analyzer(config).analyze(path=path))
+
+    while True:
+        # Only the analysis of the page is timed, not the consumer between two pages.
+        # Its self time is the rasterization and the DeepDoctection overhead besides the components.
+        with tracing.stage("analyze", document=path, page=len(serialized) + 1) as span:
+            page = next(pages, None)
+            if page is None:
+                span["end"] = True
+            else:
+                serialized.append(cache.serialize_page(page))
+
+        if page is None:
+            break
+        yield page
+
+    duration = time.perf_counter() - start
+    mode = "born-digital" if "USE_OCR=False" in config_key(config) else "ocr"
+    print(f"Analyzed {len(serialized)} pages in {duration:.1f}s ({len(serialized) / max(duration, 1e-9):.2f} pages/s, {mode})")
+
+    cache.store(key, serialized)
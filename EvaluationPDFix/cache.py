@@ -0,0 +1,202 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from pathlib import Path
+
+
+CACHE_DIR = Path(os.environ.get("PDFIX_CACHE_DIR", Path.home() / ".cache" / "pdfix"))
+MAX_CACHE_BYTES = int(os.environ.get("PDFIX_CACHE_MAX_BYTES", 1024 ** 3))
+
+
+class BoundingBox:
+    """Minimal stand-in for the DeepDoctection BoundingBox of a cached layout."""
+
+    def __init__(self, ulx, uly, lrx, lry):
+        self.ulx = ulx
+        self.uly = uly
+        self.lrx = lrx
+        self.lry = lry
+
+    @property
+    def width(self):
+        return self.lrx - self.ulx
+
+    @property
+    def height(self):
+        return self.lry - self.uly
+
+
+class CachedLayout:
+    """Layout restored from the cache, with the attributes the emitters use."""
+
+    def __init__(self, category_name, bounding_box, reading_order, text, is_header=None):
+        self.category_name = category_name
+        self.bounding_box = bounding_box
+        self.reading_order = reading_order
+        self.text = text
+        self.is_header = is_header
+
+
+class CachedPage:
+    """Page restored from the cache, with the attributes the emitters use."""
+
+    def __init__(self, layouts, width, height, location, file_name, page_number):
+        self.layouts = layouts
+        self.width = width
+        self.height = height
+        self.location = location
+        self.file_name = file_name
+        self.page_number = page_number
+
+
+def cache_key(pdf_path, config):
+    """Returns the hash of the PDF bytes combined with the analyzer config."""
+
+    sha = hashlib.sha256()
+
+    with open(pdf_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            sha.update(chunk)
+
+    sha.update(json.dumps(list(config)).encode("utf-8"))
+
+    return sha.hexdigest()
+
+
+def entry_path(key):
+    return CACHE_DIR / f"{key}.json.gz"
+
+
+def serialize_page(page):
+    """Returns the cacheable layout information of an analyzed page as a dict."""
+
+    layouts = []
+
+    for layout in page.layouts:
+        bb = layout.bounding_box
+        category = layout.category_name
+
+        layouts.append({
+            "category": getattr(category, "value", category),
+            "bbox": [bb.ulx, bb.uly, bb.lrx, bb.lry],
+            "reading_order": layout.reading_order,
+            "text": layout.text,
+            "is_header": getattr(layout, "is_header", None),
+        })
+
+    return {
+        "width": page.width,
+        "height": page.height,
+        "file_name": page.file_name,
+        "page_number": page.page_number,
+        "layouts": layouts,
+    }
+
+
+def deserialize_page(data, location):
+    layouts = [CachedLayout(l["category"], BoundingBox(*l["bbox"]), l["reading_order"], l["text"], l["is_header"])
+               for l in data["layouts"]]
+
+    return CachedPage(layouts, data["width"], data["height"], str(location), data["file_name"], data["page_number"])
+
+
+def load(key, location):
+    """Returns the cached pages for a key, or None on a cache miss."""
+
+    path = entry_path(key)
+
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            pages = json.load(file)
+
+    except (OSError, ValueError):
+        return None
+
+    # Touch the entry so eviction drops the least recently used documents first.
+    # The entry may just have been evicted by another worker, or the cache be read-only.
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+    return [deserialize_page(page, location) for page in pages]
+
+
+def store(key, pages):
+    """Writes the serialized pages of one document and evicts old entries."""
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+    # Write to a temporary file first, so parallel workers never read half an entry
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as file:
+        json.dump(pages, file)
+
+    os.replace(tmp_path, entry_path(key))
+    evict()
+
+
+def store_headers(key, page_number, flags):
+    """Adds the header flags of one page to an existing cache entry."""
+
+    store_all_headers(key, {page_number: flags})
+
+
+def store_all_headers(key, flags_by_page):
+    """Adds the header flags of several pages to an existing cache entry, rewriting it once."""
+
+    if not flags_by_page:
+        return
+
+    try:
+        with gzip.open(entry_path(key), "rt", encoding="utf-8") as file:
+            pages = json.load(file)
+
+    except (OSError, ValueError):
+        return
+
+    for page in pages:
+        flags = flags_by_page.get(page["page_number"])
+        if flags is not None:
+            for layout, flag in zip(page["layouts"], flags):
+                layout["is_header"] = flag
+
+    store(key, pages)
+
+
+def evict(max_bytes=None):
+    """Removes the least recently used entries until the cache fits in max_bytes."""
+
+    if max_bytes is None:
+        max_bytes = MAX_CACHE_BYTES
+
+    entries = []
+    for path in CACHE_DIR.glob("*.json.gz"):
+        try:
+            stat = path.stat()
+            entries.append((stat.st_mtime, stat.st_size, path))
+        except FileNotFoundError:
+            continue
+
+    total = sum(size for _, size, _ in entries)
+
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def clear():
+    """Removes every cache entry."""
+
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+    return print(f"Cache cleared ({CACHE_DIR})")
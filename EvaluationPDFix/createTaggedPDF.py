@@ -1,166 +1,361 @@
-import deepdoctection as dd
-import xml.etree.ElementTree as ET
 import io
+import os
+import shutil
+import tempfile
+import multiprocessing
 
-from pathlib import Path
+from xml.sax.saxutils import escape
 from rlextra.rml2pdf import rml2pdf
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+from analyzer import analyze, triage
+from layout_table import LayoutTable
+import tracing
 
 
-def initAnalyzer(pdf_path):
+def initAnalyzer(pdf_path, config=None, use_cache=True):
     """Initialize the DeepDoctection analyzer."""
 
-    analyzer = dd.get_dd_analyzer(config_overwrite=["LANGUAGE='nld'"])
-    path = Path.cwd() / pdf_path
-    df = analyzer.analyze(path=path)
-    doc = iter(df)
+    doc = analyze(pdf_path, triage(pdf_path, config), use_cache)
     
     return doc
 
 
-def get_bbox(layout, page_width, page_height, RL_width, RL_height):
-    """Calculates x, y, width and heigth of frame for ReportLab."""
+def ascii_text(value):
+    """Escapes text content, non-ASCII characters become character references like ElementTree writes them."""
 
-    # Get bbox from layout
-    ulx = layout.bounding_box.ulx
-    uly = layout.bounding_box.uly
-    layout_width = layout.bounding_box.width
-    layout_height = layout.bounding_box.height
+    return escape(value).encode("ascii", "xmlcharrefreplace").decode("ascii")
 
-    # Calculate frame bbox
-    y = uly + layout_height
 
-    frame_x1 = ulx / page_width * RL_width
-    frame_y1 = RL_height - (y / page_height * RL_height) # inverse because RL starting point is bottom left
-    frame_width = (layout_width / page_width * RL_width)
-    frame_height = (layout_height / page_height * RL_height)
+def attrib(value):
+    """Escapes an attribute value the same way ElementTree does."""
 
-    return frame_x1, frame_y1, frame_width, frame_height
+    value = escape(str(value), {'"': "&quot;", "\r": "&#13;", "\n": "&#10;", "\t": "&#09;"})
 
+    return value.encode("ascii", "xmlcharrefreplace").decode("ascii")
+
+
+def start_tag(tag, attributes, empty=False):
+    """Returns a serialized start tag, or an empty element tag."""
+
+    attrs = "".join(f' {key}="{attrib(value)}"' for key, value in attributes.items())
+
+    return f"<{tag}{attrs} />" if empty else f"<{tag}{attrs}>"
+
+
+def element(tag, attributes, content=None):
+    """Returns a serialized element with optional (already escaped) content."""
+
+    if content is None:
+        return start_tag(tag, attributes, empty=True)
+
+    return f"{start_tag(tag, attributes)}{content}</{tag}>"
+
+
+def write_rml(doc, metadata, filename:str, out):
+    """Writes the RML document for an analyzed PDF document to the text stream out.
+    Pages are written as they arrive from the analyzer. RML puts all frames in the
+    pageTemplate before the story, so the story is spooled to a temporary file and
+    appended at the end, which keeps memory flat for long documents."""
 
-def create_rml(doc, metadata, filename:str):
-    """Creates RML string from analyzed PDF document.
-    Returns RML string ready to be converted to tagged PDF."""
-    
     width, height = 595, 842
 
-    # Add a DOCTYPE declaration
-    doctype_declaration = '<!DOCTYPE document SYSTEM "rml_1_0.dtd">'
-    
-    # Create the document element
-    document = ET.Element("document", {"filename":filename, "compression":"0", "invariant": "1", "tagged":"1"})
+    # Add a DOCTYPE declaration and the document element
+    out.write('<!DOCTYPE document SYSTEM "rml_1_0.dtd">')
+    out.write(start_tag("document", {"filename":filename, "compression":"0", "invariant": "1", "tagged":"1"}))
 
-    docinit = ET.SubElement(document, "docinit")
-    registerTTFont = ET.SubElement(docinit, "registerTTFont", {"faceName":"Helvetica", "fileName":"font/Helvetica.ttf"})
-    registerTTFont = ET.SubElement(docinit, "registerTTFont", {"faceName":"Helvetica-Bold", "fileName":"font/HelveticaBold.ttf"})
+    out.write("<docinit>")
+    out.write(element("registerTTFont", {"faceName":"Helvetica", "fileName":"font/Helvetica.ttf"}))
+    out.write(element("registerTTFont", {"faceName":"Helvetica-Bold", "fileName":"font/HelveticaBold.ttf"}))
+    out.write("</docinit>")
 
-    # Create the template element
+    # Open the template and pageTemplate elements
     pageSize = f"({width},{height})" # A4 size 
-    template = ET.SubElement(document, "template", {
+    out.write(start_tag("template", {
         "pageSize":pageSize,
         "title":str(metadata['title']),
         "subject":str(metadata['subject']),
         "author":str(metadata['author']),
         "lang":"nl-NL"
-        })
+        }))
+    out.write('<pageTemplate id="main">')
+
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as story:
+        page_number = 0
+
+        for page in doc:
+            # Find the correct reading order and the frames of all layouts at once
+            table = LayoutTable(page)
+            frames = table.frames(page.width, page.height, width, height).tolist()
+
+            # Create all the pageTemplate frames
+            for y in table.order().tolist():
+                frame_x1, frame_y1, frame_width, frame_height = frames[y]
+                category = table.names[y]
+
+                out.write(element("frame", {
+                    "id":f"p{page_number}f{y}", 
+                    "x1":str(frame_x1), 
+                    "y1":str(frame_y1), 
+                    "width":str(frame_width), 
+                    "height":str(frame_height)
+                    }))
+
+                text = page.layouts[y].text
+                font_text = None if text is None else ascii_text(text)
+
+                # PARAGRAPH
+                if category == "text":
+                    font = element("font", {"face":"Helvetica"}, font_text)
+                    para = element("para", {"tagType":"P", "style":"para"}, font)
+                    story.write(element("keepInFrame", {"onOverflow":"shrink", "id":f"p{page_number}ff{y}", "frame":f"p{page_number}f{y}"}, para))
+
+                # HEADING
+                elif category == "title":
+                    font = element("font", {"face":"Helvetica-Bold"}, font_text)
+                    heading = element("h1", {"tagType":"H1", "style":"h1"}, font)
+                    story.write(element("keepInFrame", {"onOverflow":"overflow", "id":f"p{page_number}ff{y}", "frame":f"p{page_number}f{y}"}, heading))
+
+                # LIST
+                elif category == "list":
+                    font = element("font", {"face":"Helvetica"}, font_text)
+                    para = element("para", {"tagType":"P", "style":"para"}, font)
+                    story.write(element("keepInFrame", {"onOverflow":"shrink", "id":f"p{page_number}ff{y}", "frame":f"p{page_number}f{y}"}, para))
+
+                # FIGURE
+                else:
+                    print(page.layouts[y].category_name) 
+
+            story.write("<nextPage />")
+            page_number += 1
+
+        out.write("</pageTemplate></template>")
+
+        # Create stylesheet element
+        out.write("<stylesheet>")
+        out.write(element("paraStyle", {"name": "h1", "fontName": "Helvetica-Bold", "fontSize": "9"}))
+        out.write(element("paraStyle", {"name": "para", "fontName": "Helvetica", "fontSize": "9"}))
+        out.write("</stylesheet>")
+
+        # Append the spooled story element
+        out.write("<story>")
+        story.seek(0)
+        shutil.copyfileobj(story, out)
+        out.write("</story>")
+
+    out.write("</document>")
 
-    # Create pageTemplate element
-    pageTemplate = ET.SubElement(template, "pageTemplate", {"id":"main"})
 
-    # Create stylesheet element
-    stylesheet = ET.SubElement(document, "stylesheet")
+def create_rml(doc, metadata, filename:str):
+    """Creates RML string from analyzed PDF document.
+    Returns RML string ready to be converted to tagged PDF."""
 
-    paraStyle = ET.SubElement(stylesheet, "paraStyle", {
-        "name": "h1",
-        "fontName": "Helvetica-Bold",
-        "fontSize": "9"
-    })
+    xml_string = io.StringIO()
+    write_rml(doc, metadata, filename, xml_string)
 
-    paraStyle = ET.SubElement(stylesheet, "paraStyle", {
-        "name": "para",
-        "fontName": "Helvetica",
-        "fontSize": "9"
-    })
+    return xml_string.getvalue()
 
-    # Create story element
-    story = ET.SubElement(document, "story")
 
-    page_number = 0
+def create_rml_file(doc, metadata, filename:str, rml_path):
+    """Writes the RML for an analyzed PDF document to rml_path, without holding it in memory."""
 
-    for page in doc:
-        # Find the correct reading order
-        reading_o_list = []
-        index_list = []
-        for i in range(len(page.layouts)):
-            reading_o_list.append(page.layouts[i].reading_order)
-            index_list.append(i)
-        
-        reading_o_sorted = [x for _, x in sorted(zip(reading_o_list, index_list))]
-        
-        # Create all the pageTemplate frames
-        for y in reading_o_sorted:
-            frame_x1, frame_y1, frame_width, frame_height = get_bbox(page.layouts[y], page.width, page.height, width, height)
-            
-            frame = ET.SubElement(pageTemplate, "frame", {
-                "id":f"p{page_number}f{y}", 
-                "x1":str(frame_x1), 
-                "y1":str(frame_y1), 
-                "width":str(frame_width), 
-                "height":str(frame_height)
-                })
-        
-            # PARAGRAPH
-            if page.layouts[y].category_name == "text":
-                keepInFrame = ET.SubElement(story, "keepInFrame", {"onOverflow":"shrink", "id":f"p{page_number}ff{y}", "frame":f"p{page_number}f{y}"})
-                para = ET.SubElement(keepInFrame, "para", {"tagType":"P", "style":"para"})
-                font = ET.SubElement(para, "font", {"face":"Helvetica"})
-                font.text = page.layouts[y].text
-
-            # HEADING
-            elif page.layouts[y].category_name == "title":
-                keepInFrame = ET.SubElement(story, "keepInFrame", {"onOverflow":"overflow", "id":f"p{page_number}ff{y}", "frame":f"p{page_number}f{y}"})
-                heading = ET.SubElement(keepInFrame, "h1", {"tagType":"H1", "style":"h1"})
-                font = ET.SubElement(heading, "font", {"face":"Helvetica-Bold"})
-                font.text = page.layouts[y].text
-
-            # LIST
-            elif page.layouts[y].category_name == "list":
-                keepInFrame = ET.SubElement(story, "keepInFrame", {"onOverflow":"shrink", "id":f"p{page_number}ff{y}", "frame":f"p{page_number}f{y}"})
-                para = ET.SubElement(keepInFrame, "para", {"tagType":"P", "style":"para"})
-                font = ET.SubElement(para, "font", {"face":"Helvetica"})
-                font.text = page.layouts[y].text
-
-            # FIGURE
-            else:
-                print(page.layouts[y].category_name) 
-                
-                
-        nextPage = ET.SubElement(story, "nextPage")
-        page_number += 1
-        
-
-    # Create the XML tree
-    tree = ET.ElementTree(document)
-
-    # Use an in-memory file-like object
-    xml_content = io.BytesIO()
-    tree.write(xml_content, xml_declaration=False)
-
-    # Get the XML content as bytes
-    xml_bytes = xml_content.getvalue()
-
-    # Decode the bytes to a string if needed
-    xml_string = doctype_declaration + xml_bytes.decode('utf-8')
-
-    return xml_string
+    # Pages analyzed while the RML is written are recorded as stages inside this one
+    with tracing.stage("rml"), open(rml_path, "w", encoding="utf-8") as out:
+        write_rml(doc, metadata, filename, out)
+
+    return rml_path
+
+
+def read_rml(rml_path):
+    """Returns the RML text of a file written by create_rml_file, rml2pdf.go takes RML text."""
+
+    with open(rml_path, encoding="utf-8") as file:
+        return file.read()
 
 
 def create_tagged_pdf(RML, outputFilePath):
-    """Converts XML string to tagged PDF."""
+    """Converts XML string to tagged PDF. A failed conversion is reported and raised again,
+    so batch mode counts the file as failed."""
     
     try:
-        rml2pdf.go(RML, outputFilePath)
+        with tracing.stage("render"):
+            rml2pdf.go(RML, outputFilePath)
     
     except Exception as e:
         print(f"Error converting RML to PDF (ReportLab): {str(e)}")
+        raise
     
     return print(f"PDF converted to {outputFilePath}")
+
+
+def split_pages(doc, pages_per_part):
+    """Groups the pages of the analyzer iterator into lists of pages_per_part pages."""
+
+    part = []
+    for page in doc:
+        part.append(page)
+        if len(part) == pages_per_part:
+            yield part
+            part = []
+
+    if part:
+        yield part
+
+
+def render_part(job):
+    """Renders the RML of one page range to PDF in a worker process."""
+
+    rml_path, output_path, document, part = job
+    with tracing.stage("render", document=document, part=part):
+        rml2pdf.go(read_rml(rml_path), output_path)
+
+    return output_path
+
+
+def create_tagged_pdf_parallel(doc, metadata, outputFilePath, pages_per_part=10, workers=None):
+    """Renders the document in page ranges of pages_per_part pages, each range in its own process,
+    and merges the tagged parts into outputFilePath. Ranges are handed to the pool as soon as their
+    pages are analyzed, so rendering overlaps with the analysis of the next range."""
+
+    filename = os.path.basename(outputFilePath)
+    tmp_dir = tempfile.mkdtemp()
+
+    try:
+        with multiprocessing.Pool(processes=workers) as pool:
+            results = []
+
+            for i, pages in enumerate(split_pages(doc, pages_per_part)):
+                rml_path = create_rml_file(pages, metadata, filename, os.path.join(tmp_dir, f"part{i}.rml"))
+                job = (rml_path, os.path.join(tmp_dir, f"part{i}.pdf"), filename, i)
+                results.append(pool.apply_async(render_part, (job,)))
+
+            parts = [result.get() for result in results]
+
+        with tracing.stage("merge"):
+            merge_tagged_pdfs(parts, outputFilePath)
+
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return print(f"PDF converted to {outputFilePath}")
+
+
+def set_struct_parents(element_ref):
+    """Points the /P entry of every structure element below element_ref to its parent."""
+
+    kids = element_ref.get_object().get("/K")
+    if kids is None:
+        return
+
+    for kid in (kids if isinstance(kids, ArrayObject) else [kids]):
+        if isinstance(kid, IndirectObject) and "/S" in kid.get_object():
+            kid.get_object()[NameObject("/P")] = element_ref
+            set_struct_parents(kid)
+
+
+def parent_tree_items(node):
+    """Returns the (key, value) pairs of a number tree, following its /Kids."""
+
+    node = node.get_object()
+    items = []
+
+    nums = node.get("/Nums", [])
+    for i in range(0, len(nums), 2):
+        items.append((int(nums[i]), nums[i + 1]))
+
+    for kid in node.get("/Kids", []):
+        items.extend(parent_tree_items(kid))
+
+    return items
+
+
+# pypdf has no public way to add an indirect object to a PdfWriter (up to at least pypdf 5.0) and makes the
+# catalog public as root_object only from pypdf 4, so merging needs the pypdf==3.17.2 of requirements.txt,
+# or a later release that still has these members.
+def add_object(writer, obj):
+    """Adds obj to writer as indirect object and returns the reference."""
+
+    return writer._add_object(obj)
+
+
+def root_object(writer):
+    """Returns the catalog of writer."""
+
+    return writer.root_object if hasattr(type(writer), "root_object") else writer._root_object
+
+
+def merge_tagged_pdfs(part_paths, outputFilePath):
+    """Concatenates tagged PDFs while keeping one structure tree.
+    The Document elements of the parts are joined under a single Document element,
+    and the StructParents keys of every part are shifted so the ParentTree stays valid.
+    Catalog entries like Lang, MarkInfo and the metadata are taken from the first part."""
+
+    writer = PdfWriter()
+
+    struct_root = add_object(writer, DictionaryObject({NameObject("/Type"): NameObject("/StructTreeRoot")}))
+    document = add_object(writer, DictionaryObject({
+        NameObject("/Type"): NameObject("/StructElem"),
+        NameObject("/S"): NameObject("/Document"),
+        NameObject("/K"): ArrayObject(),
+    }))
+    struct_root.get_object()[NameObject("/K")] = ArrayObject([document])
+
+    nums = ArrayObject()
+    offset = 0
+
+    for i, path in enumerate(part_paths):
+        reader = PdfReader(path)
+        catalog = reader.trailer["/Root"]
+        first_page = len(writer.pages)
+
+        writer.append(reader, import_outline=False)
+
+        if i == 0:
+            for key in ["/Lang", "/MarkInfo", "/ViewerPreferences", "/Metadata"]:
+                if key in catalog:
+                    root_object(writer)[NameObject(key)] = catalog.raw_get(key).clone(writer)
+            if reader.metadata is not None:
+                writer.add_metadata(reader.metadata)
+
+        if "/StructTreeRoot" not in catalog:
+            continue
+
+        part_root = catalog["/StructTreeRoot"]
+
+        if i == 0:
+            for key in ["/RoleMap", "/ClassMap"]:
+                if key in part_root:
+                    struct_root.get_object()[NameObject(key)] = part_root.raw_get(key).clone(writer)
+
+        # Take the children of the part's Document element, the /P entries are restored afterwards
+        kids = part_root.get("/K", ArrayObject())
+        kids = kids if isinstance(kids, ArrayObject) else ArrayObject([kids])
+        if len(kids) == 1 and kids[0].get_object().get("/S") == "/Document":
+            kids = kids[0].get_object().get("/K", ArrayObject())
+            kids = kids if isinstance(kids, ArrayObject) else ArrayObject([kids])
+
+        for kid in kids:
+            document.get_object()["/K"].append(kid.clone(writer, ignore_fields=("/P",)))
+
+        # Shift the ParentTree keys, and the StructParents of the pages that use them.
+        # pypdf drops StructParents when copying pages, so they are taken from the part.
+        items = parent_tree_items(part_root["/ParentTree"]) if "/ParentTree" in part_root else []
+        for key, value in items:
+            nums.append(NumberObject(key + offset))
+            nums.append(value.clone(writer, ignore_fields=("/P",)))
+
+        for page, part_page in zip(writer.pages[first_page:], reader.pages):
+            if "/StructParents" in part_page:
+                page[NameObject("/StructParents")] = NumberObject(part_page["/StructParents"] + offset)
+
+        offset += max((key for key, _ in items), default=-1) + 1
+
+    struct_root.get_object()[NameObject("/ParentTree")] = add_object(writer, DictionaryObject({NameObject("/Nums"): nums}))
+    struct_root.get_object()[NameObject("/ParentTreeNextKey")] = NumberObject(offset)
+    root_object(writer)[NameObject("/StructTreeRoot")] = struct_root
+
+    document.get_object()[NameObject("/P")] = struct_root
+    set_struct_parents(document)
+
+    with open(outputFilePath, "wb") as file:
+        writer.write(file)
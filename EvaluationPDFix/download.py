@@ -0,0 +1,276 @@
+"""
+Downloads the PDF documents of a WOO manifest with a pool of threads.
+
+Every thread keeps one HTTP session, so connections are reused. A download is written to
+<id>.pdf.part and only renamed once it is complete, an interrupted run continues the .part
+file with a Range request. Finished downloads are logged with their sha256 in downloads.jsonl,
+files that are present with the logged hash are skipped.
+
+    python download.py -i ../evaluation/Beslisnotas2024.csv -o ../evaluation/BeslisnotaPDFs -w 8
+    python download.py -i woo_dossiers.csv --dc-type 2e-b -o pdfs --base-url http://localhost:8000
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import manifest
+
+
+DOI_URL = "https://doi.wooverheid.nl/?doi="
+CHUNK_SIZE = 1 << 16
+LOG_NAME = "downloads.jsonl"
+
+# Responses that are worth another attempt, any other HTTP error moves on to the next URL
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+_local = threading.local()
+
+
+def argumentParse():
+    parser = argparse.ArgumentParser(description='Downloads the PDF documents of a WOO manifest.')
+
+    parser.add_argument('-i', '--input', type=str, help='CSV manifest with a dc_source or identifier column.')
+    parser.add_argument('-o', '--output', type=str, help='Output directory for the pdf files.')
+
+    # optional arguments
+    parser.add_argument('-w', '--workers', type=int,
+                        help='Number of download threads', default=8)
+    parser.add_argument('-n', '--limit', type=int,
+                        help='Only download the first n documents', default=None)
+    parser.add_argument('--dc-type', type=str,
+                        help='Only download documents of this dc_type, e.g. 2e-b', default=None)
+    parser.add_argument('--base-url', type=str,
+                        help='Replaces scheme and host of every URL, e.g. a local test server', default=None)
+    parser.add_argument('--retries', type=int,
+                        help='Attempts per URL', default=3)
+    parser.add_argument('--timeout', type=float,
+                        help='Timeout in seconds per request', default=60)
+
+    return parser.parse_args()
+
+
+def get_session():
+    """Returns the HTTP session of the current thread. Failed requests are retried by fetch,
+    which also continues a body that was cut off, so the session itself does not retry."""
+
+    if not hasattr(_local, "session"):
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _local.session = session
+
+    return _local.session
+
+
+def rebase(url, base_url):
+    """Replaces scheme and host of url by those of base_url."""
+
+    if not base_url:
+        return url
+
+    parts = urlsplit(url)
+    query = f"?{parts.query}" if parts.query else ""
+
+    return f"{base_url.rstrip('/')}{parts.path}{query}"
+
+
+def candidate_urls(row, identifier, base_url=None):
+    """Returns the URLs a document can be downloaded from, in the order they are tried."""
+
+    source = row.get("dc_source")
+
+    if isinstance(source, str) and source:
+        url = rebase(source, base_url)
+
+        # open.overheid.nl serves a document under /pdf or /file, the manifest lists either one
+        head, _, tail = url.rpartition("/")
+        if tail in ("pdf", "file"):
+            return [url, f"{head}/{'file' if tail == 'pdf' else 'pdf'}"]
+        return [url]
+
+    return [rebase(DOI_URL + identifier, base_url)]
+
+
+def sha256_file(path):
+    sha = hashlib.sha256()
+
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def is_pdf(path):
+    with open(path, "rb") as file:
+        return file.read(5) == b"%PDF-"
+
+
+def fetch(urls, path, retries=3, timeout=60):
+    """Downloads the first URL that returns a PDF to path and returns that URL.
+    Every URL gets up to retries attempts on connection errors and RETRY_STATUS responses.
+    A .part file left by an earlier attempt is continued with a Range request."""
+
+    part = f"{path}.part"
+    session = get_session()
+    errors = []
+
+    for url in urls:
+        complete = False
+
+        for attempt in range(retries):
+            if attempt:
+                time.sleep(0.5 * 2 ** (attempt - 1))
+
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+            try:
+                with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                    # Nothing left to fetch, the .part file already holds the whole document
+                    if response.status_code == 416 and offset:
+                        complete = True
+                        break
+
+                    response.raise_for_status()
+
+                    # A server that ignores the Range header sends the whole document again
+                    mode = "ab" if response.status_code == 206 else "wb"
+                    with open(part, mode) as file:
+                        for chunk in response.iter_content(CHUNK_SIZE):
+                            file.write(chunk)
+
+                complete = True
+                break
+
+            except requests.HTTPError as e:
+                errors.append(f"{url}: {str(e)}")
+                if e.response is not None and e.response.status_code not in RETRY_STATUS:
+                    break
+
+            except requests.RequestException as e:
+                errors.append(f"{url}: {type(e).__name__}")
+
+        if not complete:
+            continue
+
+        if is_pdf(part):
+            os.replace(part, path)
+            return url
+
+        # Not a PDF (e.g. an error page), the next URL starts from scratch
+        errors.append(f"{url}: not a pdf")
+        if os.path.exists(part):
+            os.remove(part)
+
+    raise RuntimeError("; ".join(errors) or "no url")
+
+
+def read_log(output_dir):
+    """Returns the logged download of every identifier."""
+
+    records = {}
+    path = os.path.join(output_dir, LOG_NAME)
+
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                    records[record["id"]] = record
+                except (ValueError, KeyError):
+                    continue  # a line cut off by an interrupted run
+
+    return records
+
+
+def download_job(identifier, urls, output_dir, record, retries, timeout):
+    """Downloads one document unless it is present with the logged hash.
+    Returns the identifier, the status, the log record and an error message."""
+
+    path = os.path.join(output_dir, f"{identifier}.pdf")
+
+    try:
+        if os.path.exists(path):
+            digest = sha256_file(path)
+
+            if record is not None and record["sha256"] == digest:
+                return identifier, "present", None, None
+
+            # A complete file from before the log existed is adopted instead of downloaded again
+            if record is None and is_pdf(path):
+                return identifier, "present", {"id": identifier, "url": None, "sha256": digest,
+                                               "size": os.path.getsize(path)}, None
+
+            os.remove(path)
+
+        url = fetch(urls, path, retries, timeout)
+
+        return identifier, "downloaded", {"id": identifier, "url": url, "sha256": sha256_file(path),
+                                          "size": os.path.getsize(path)}, None
+
+    except Exception as e:
+        return identifier, "failed", None, f"{type(e).__name__}: {str(e)}"
+
+
+def download(manifest_path, output_dir, workers=8, dc_type=None, base_url=None, limit=None, retries=3, timeout=60):
+    """Downloads all documents of a manifest that are not present yet.
+    Returns the identifiers that failed."""
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    df = manifest.load(manifest_path, dc_type=dc_type)
+    key = manifest.key_column(df.columns)
+    rows = df.dropna(subset=[key]).drop_duplicates(key).to_dict("records")[:limit]
+
+    records = read_log(output_dir)
+    failed = []
+    counts = {"present": 0, "downloaded": 0, "failed": 0}
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool, \
+            open(os.path.join(output_dir, LOG_NAME), "a", encoding="utf-8") as log:
+
+        futures = [pool.submit(download_job, row[key], candidate_urls(row, row[key], base_url), output_dir,
+                               records.get(row[key]), retries, timeout) for row in rows]
+
+        for i, future in enumerate(as_completed(futures), 1):
+            identifier, status, record, error = future.result()
+            counts[status] += 1
+
+            # Only this thread writes the log, so lines never interleave
+            if record is not None:
+                log.write(json.dumps(record) + "\n")
+                log.flush()
+
+            if status == "failed":
+                failed.append(identifier)
+                print(f"[{i}/{len(rows)}] {identifier} failed: {error}")
+            elif status == "downloaded":
+                print(f"[{i}/{len(rows)}] {identifier}: {record['size']} bytes")
+
+    print(f"{counts['downloaded']} downloaded, {counts['present']} already present, {counts['failed']} failed "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    return failed
+
+
+if __name__ == '__main__':
+    args = argumentParse()
+
+    failed = download(args.input, args.output, args.workers, args.dc_type, args.base_url, args.limit,
+                      args.retries, args.timeout)
+
+    sys.exit(1 if failed else 0)
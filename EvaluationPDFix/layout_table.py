@@ -0,0 +1,62 @@
+import numpy as np
+
+
+# Layout categories DeepDoctection produces, the position in the list is the category code
+CATEGORIES = ["text", "title", "list", "line", "table", "figure"]
+CATEGORY_CODES = {name: code for code, name in enumerate(CATEGORIES)}
+
+
+class LayoutTable:
+    """
+    Columns of all layouts on one page as NumPy arrays, built once from the DeepDoctection page.
+    Row i belongs to page.layouts[i], so emitters sort and transform the whole page at once
+    and still read the text from the layout itself.
+    """
+
+    def __init__(self, page):
+        self.layouts = list(page.layouts)
+        self.names = []
+
+        rows = []
+        for layout in self.layouts:
+            bb = layout.bounding_box
+            category = getattr(layout.category_name, "value", layout.category_name)
+            reading_order = layout.reading_order
+
+            self.names.append(category)
+            rows.append((bb.ulx, bb.uly, bb.lrx, bb.lry, bb.width, bb.height,
+                         np.nan if reading_order is None else reading_order,
+                         CATEGORY_CODES.get(category, -1),
+                         bool(getattr(layout, "is_header", None))))
+
+        columns = np.array(rows, dtype=np.float64).reshape(-1, 9).T
+
+        self.ulx, self.uly, self.lrx, self.lry, self.width, self.height, self.reading_order = columns[:7]
+        self.category = columns[7].astype(np.int64)
+        self.is_header = columns[8].astype(bool)
+
+    def __len__(self):
+        return len(self.layouts)
+
+    def order(self):
+        """Returns the layout indices in reading order, ties keep the layout order.
+        Layouts without a reading order come last."""
+        return np.argsort(self.reading_order, kind="stable")
+
+    def top_down(self):
+        """Returns the layout indices sorted from the top of the page down."""
+        return np.argsort(self.uly, kind="stable")
+
+    def centroids(self, scale=1.0):
+        """Returns the x and y arrays of the layout centres, with the corners scaled by scale first."""
+        return (self.ulx * scale + self.lrx * scale) / 2, (self.uly * scale + self.lry * scale) / 2
+
+    def frames(self, page_width, page_height, RL_width, RL_height):
+        """Returns x, y, width and height of the ReportLab frame of every layout as an (n, 4) array."""
+
+        frame_x1 = self.ulx / page_width * RL_width
+        frame_y1 = RL_height - ((self.uly + self.height) / page_height * RL_height) # inverse because RL starting point is bottom left
+        frame_width = self.width / page_width * RL_width
+        frame_height = self.height / page_height * RL_height
+
+        return np.stack([frame_x1, frame_y1, frame_width, frame_height], axis=1)
@@ -0,0 +1,218 @@
+import csv
+import glob
+import bisect
+import hashlib
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from cache import CACHE_DIR
+
+
+MANIFEST_DIR = CACHE_DIR / "manifests"
+
+# Columns kept from the WOO dossier export and the Beslisnota evaluation set, all others are dropped.
+# path is the pdf file of a row, relative to the CSV, in manifests written for a batch.
+COLUMNS = ["dc_identifier", "id", "dc_type", "dc_title", "dc_description", "dc_publisher_name", "dc_source",
+           "foi_publishedDate", "foi_nrPages", "foi_fairiscoreVersions", "foi_fairiscore_v2", "path"]
+
+# Columns read as text, so identifiers and dates are never parsed as numbers
+TEXT_COLUMNS = ["dc_identifier", "id", "dc_type", "dc_title", "dc_description", "dc_publisher_name", "dc_source",
+                "foi_publishedDate", "path"]
+
+# Columns holding a JSON object per row, expanded into one column per key when the cache is built
+JSON_COLUMNS = ["foi_fairiscoreVersions"]
+
+INDEX_KEY = b"pdfix_manifest_index"
+
+
+def cache_path(csv_path):
+    """Returns the path of the columnar cache of a CSV manifest."""
+
+    csv_path = os.path.abspath(csv_path)
+    digest = hashlib.sha1(csv_path.encode("utf-8")).hexdigest()[:12]
+
+    return MANIFEST_DIR / f"{os.path.splitext(os.path.basename(csv_path))[0]}.{digest}.feather"
+
+
+def source_stamp(csv_path):
+    stat = os.stat(csv_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def sniff_delimiter(csv_path):
+    with open(csv_path, newline="", encoding="utf-8-sig") as file:
+        return csv.Sniffer().sniff(file.read(4096), delimiters=",;").delimiter
+
+
+def expand_json(df, column):
+    """Replaces a column of JSON objects by one column per key, e.g. foi_fairiscoreVersions_v1."""
+
+    values = [json.loads(value) if isinstance(value, str) else {} for value in df[column]]
+    expanded = pd.DataFrame.from_records(values, index=df.index).add_prefix(f"{column}_")
+
+    return pd.concat([df.drop(columns=column), expanded], axis=1)
+
+
+def key_column(names):
+    return "dc_identifier" if "dc_identifier" in names else "id"
+
+
+def convert(csv_path, columns=None):
+    """Converts a CSV manifest once into an uncompressed Feather file with only the needed columns.
+    Rows are sorted on dc_type and identifier, and the row range of every dc_type is stored
+    in the schema metadata, so filtered loads slice the memory mapped file instead of scanning it."""
+
+    delimiter = sniff_delimiter(csv_path)
+    header = pd.read_csv(csv_path, sep=delimiter, encoding="utf-8-sig", nrows=0).columns
+    usecols = [column for column in (columns or COLUMNS) if column in header]
+
+    df = pd.read_csv(csv_path, sep=delimiter, encoding="utf-8-sig", usecols=usecols,
+                     dtype={column: str for column in TEXT_COLUMNS if column in usecols})
+
+    for column in JSON_COLUMNS:
+        if column in df:
+            df = expand_json(df, column)
+
+    key = key_column(df.columns)
+    sort = [column for column in ("dc_type", key) if column in df]
+    df = df.sort_values(sort, kind="stable", na_position="last").reset_index(drop=True)
+
+    # Row range per dc_type, the whole table is one range if the manifest has no types.
+    # The third number ends the rows with an identifier, which are sorted before the rows without one.
+    ranges = {}
+    groups = df.groupby("dc_type", sort=False).indices.items() if "dc_type" in df else [("", range(len(df)))]
+    for dc_type, rows in groups:
+        if not len(rows):
+            continue
+        start, stop = int(rows[0]), int(rows[-1]) + 1
+        ranges[dc_type] = [start, stop, start + int(df[key].iloc[start:stop].notna().sum())]
+
+    index = {"source": source_stamp(csv_path), "columns": columns or COLUMNS, "key": key,
+             "typed": "dc_type" in df, "ranges": ranges}
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), INDEX_KEY: json.dumps(index).encode("utf-8")})
+
+    # Write to a temporary file first, so parallel readers never map half a file
+    path = cache_path(csv_path)
+    MANIFEST_DIR.mkdir(parents=True, exist_ok=True)
+    feather.write_feather(table, f"{path}.tmp", compression="uncompressed")
+    os.replace(f"{path}.tmp", path)
+
+    print(f"Manifest cached ({path})")
+    return path
+
+
+def read_index(table):
+    return json.loads(table.schema.metadata[INDEX_KEY])
+
+
+def open_table(csv_path, columns=None):
+    """Returns the memory mapped table of a CSV manifest, converting the CSV first if it changed
+    or was cached with other columns."""
+
+    path = cache_path(csv_path)
+
+    if path.exists():
+        table = feather.read_table(path, columns=columns, memory_map=True)
+        index = read_index(table)
+        if index["source"] == source_stamp(csv_path) and index.get("columns") == COLUMNS:
+            return table
+
+    convert(csv_path)
+    return feather.read_table(path, columns=columns, memory_map=True)
+
+
+def type_range(csv_path, index, dc_type):
+    """Returns the row range of dc_type, raises ValueError for a manifest without dc_type column."""
+
+    if not index["typed"]:
+        raise ValueError(f"{csv_path} has no dc_type column to select {dc_type} from")
+
+    return index["ranges"].get(dc_type, [0, 0, 0])
+
+
+def load(csv_path, dc_type=None, columns=None):
+    """Returns the manifest as DataFrame, only the rows of dc_type if given.
+    Rows are sorted on dc_type and identifier."""
+
+    table = open_table(csv_path, columns)
+
+    if dc_type is not None:
+        start, stop, _ = type_range(csv_path, read_index(table), dc_type)
+        table = table.slice(start, stop - start)
+
+    return table.to_pandas()
+
+
+class Column:
+    """Sequence view on an Arrow column, so bisect reads only the rows it compares."""
+
+    def __init__(self, column, start, stop):
+        self.column = column
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, i):
+        return self.column[self.start + i].as_py()
+
+
+def lookup(csv_path, identifier, dc_type=None):
+    """Returns the manifest row of one identifier as dict, or None.
+    Each dc_type range is sorted on identifier, so this is a binary search per type."""
+
+    table = open_table(csv_path)
+    index = read_index(table)
+    column = table.column(index["key"])
+
+    ranges = index["ranges"]
+    if dc_type is not None:
+        ranges = {dc_type: type_range(csv_path, index, dc_type)}
+
+    for start, _, stop in ranges.values():
+        i = bisect.bisect_left(Column(column, start, stop), identifier)
+        if i < stop - start and column[start + i].as_py() == identifier:
+            return table.slice(start + i, 1).to_pylist()[0]
+
+    return None
+
+
+def collect_inputs(source, pdf_dir=None):
+    """Resolves a directory, pdf file, glob or manifest to a list of pdf paths.
+    A CSV manifest gives the path column of a row relative to the CSV, or else its identifier
+    as file name in pdf_dir (by default the directory of the CSV). Any other file lists one
+    path per line, relative to that file."""
+
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, "*.pdf")))
+
+    if not os.path.isfile(source):
+        return sorted(glob.glob(source, recursive=True))
+
+    if source.lower().endswith(".pdf"):
+        return [source]
+
+    base_dir = os.path.dirname(source)
+
+    if not source.lower().endswith(".csv"):
+        with open(source, encoding="utf-8") as file:
+            return [os.path.join(base_dir, line.strip()) for line in file if line.strip()]
+
+    df = load(source)
+    key = key_column(df.columns)
+    paths = []
+
+    for row in df.to_dict("records"):
+        if isinstance(row.get("path"), str) and row["path"]:
+            paths.append(os.path.join(base_dir, row["path"]))
+        elif isinstance(row.get(key), str) and row[key]:
+            paths.append(os.path.join(base_dir if pdf_dir is None else pdf_dir, f"{row[key]}.pdf"))
+
+    return paths
@@ -1,108 +1,149 @@
 from pypdf import PdfReader
+from functools import lru_cache
 import datetime
+import math
+import os
 
 
-def get_metadata(file_path, force_mode):
-    """Return a dictionary with the metadata of a PDF file."""
+FIELDS = ["title", "author", "subject", "creator", "producer", "creation_date", "mod_date"]
 
-    metadata = {}
+# WOO manifest column each metadata field is read from
+MANIFEST_COLUMNS = {
+    "title": "dc_title",
+    "author": "dc_publisher_name",
+    "subject": "dc_description",
+    "creation_date": "foi_publishedDate",
+}
+
+
+def is_missing(value):
+    """True for None, empty strings and the NaN pandas uses for empty CSV cells."""
+
+    return value is None or value == "" or (isinstance(value, float) and math.isnan(value))
+
+
+def info_value(info, attribute):
+    """Returns one Info dict value, None if it is absent or cannot be parsed (e.g. a malformed date)."""
+
+    try:
+        return getattr(info, attribute)
+    except Exception:
+        return None
+
+
+def xmp_value(value):
+    """Returns a plain value for an XMP entry, which can be a language alternative or a list."""
+
+    if isinstance(value, dict):
+        return value.get("x-default") or next(iter(value.values()), None)
+    if isinstance(value, list):
+        return "; ".join(str(item) for item in value) or None
+    return value
+
+
+@lru_cache(maxsize=64)
+def _read_info(file_path, mtime):
+    # PdfReader only reads the trailer and cross reference table here, the page tree is never parsed
+    reader = PdfReader(file_path)
+    info = reader.metadata
+
+    values = dict.fromkeys(FIELDS)
+    if info is not None:
+        for field, attribute in [("title", "title"), ("author", "author"), ("subject", "subject"),
+                                 ("creator", "creator"), ("producer", "producer"),
+                                 ("creation_date", "creation_date"), ("mod_date", "modification_date")]:
+            values[field] = info_value(info, attribute)
+
+    # Only parse the XMP packet for the fields the Info dict does not have
+    if any(is_missing(values[field]) for field in FIELDS):
+        try:
+            xmp = reader.xmp_metadata
+        except Exception:
+            xmp = None
+
+        if xmp is not None:
+            for field, attribute in [("title", "dc_title"), ("author", "dc_creator"), ("subject", "dc_description"),
+                                     ("creator", "xmp_creator_tool"), ("producer", "pdf_producer"),
+                                     ("creation_date", "xmp_create_date"), ("mod_date", "xmp_modify_date")]:
+                if is_missing(values[field]):
+                    values[field] = xmp_value(info_value(xmp, attribute))
+
+    return values
+
+
+def read_info(file_path):
+    """Returns the Info dict and XMP values of a PDF, opening every file only once per process."""
+
+    file_path = os.path.abspath(file_path)
+    return dict(_read_info(file_path, os.path.getmtime(file_path)))
+
+
+def manifest_values(row):
+    """Returns the metadata fields of one WOO manifest row (a dict or DataFrame row)."""
+
+    return {field: row.get(column) for field, column in MANIFEST_COLUMNS.items()}
+
+
+def index_manifest(rows, keys=("dc_identifier", "id")):
+    """Returns the metadata fields of all manifest rows by identifier, for O(1) lookup per document."""
+
+    index = {}
+    for row in rows:
+        identifier = next((row[key] for key in keys if not is_missing(row.get(key))), None)
+        if identifier is not None:
+            index[identifier] = manifest_values(row)
+
+    return index
+
+
+def get_record(file_path, manifest=None, default="Undefined"):
+    """Return one merged metadata record without asking for input.
+    Manifest values come first, then the Info dict and XMP of the PDF, then default.
+    A missing modification date becomes the current time."""
 
     try:
-        reader = PdfReader(file_path)
-
-        if reader.metadata == None:
-            if force_mode is True:
-                metadata['title'] = 'Undefined'
-                metadata['author'] = 'Undefined'
-                metadata['subject'] = 'Undefined'
-                metadata['creator'] = 'Undefined'
-                metadata['producer'] = 'Undefined'
-                metadata['mod_date'] = datetime.datetime.now()
-            
-            else:
-                metadata['title'] = input('Insert metadata "Title": ')
-                metadata['author'] = input('Insert metadata "Author": ')
-                metadata['subject'] = input('Insert metadata "Subject": ')
-                metadata['creator'] = input('Insert metadata "Creator": ')
-                metadata['producer'] = input('Insert metadata "Producer": ')
-                metadata['creation_date'] = datetime.datetime.now()
-                metadata['mod_date'] = datetime.datetime.now()      
-
-        else:
-            metadata['title'] = reader.metadata.title
-            metadata['author'] = reader.metadata.author
-            metadata['subject'] = reader.metadata.subject
-            metadata['creator'] = reader.metadata.creator
-            metadata['producer'] = reader.metadata.producer
-            metadata['creation_date'] = reader.metadata.creation_date
-            metadata['mod_date'] = reader.metadata.modification_date
-
-            if force_mode is True:
-                if metadata['title'] is None:
-                    metadata['title'] = 'Undefined'
-                if metadata['author'] is None:
-                    metadata['author'] = 'Undefined'
-                if metadata['subject'] is None:
-                    metadata['subject'] = 'Undefined'
-                if metadata['creator'] is None:
-                    metadata['creator'] = 'Undefined'
-                if metadata['producer'] is None:
-                    metadata['producer'] = 'Undefined'
-                if metadata['mod_date'] is None:
-                    metadata['mod_date'] = datetime.datetime.now()
-
-            else: 
-                if metadata['title'] is None:
-                    metadata['title'] = input('Insert metadata "Title": ')
-                if metadata['author'] is None:
-                    metadata['author'] = input('Insert metadata "Author": ')
-                if metadata['subject'] is None:
-                    metadata['subject'] = input('Insert metadata "Subject": ')
-                if metadata['creator'] is None:
-                    metadata['creator'] = input('Insert metadata "Creator": ')
-                if metadata['producer'] is None:
-                    metadata['producer'] = input('Insert metadata "Producer": ')
-                if metadata['mod_date'] is None:
-                    metadata['mod_date'] = datetime.datetime.now()
+        metadata = read_info(file_path)
 
     except Exception as e:
         print("Error: " + str(e))
+        metadata = dict.fromkeys(FIELDS)
+
+    for field, value in (manifest or {}).items():
+        if not is_missing(value):
+            metadata[field] = value
+
+    for field in FIELDS:
+        if is_missing(metadata[field]):
+            metadata[field] = datetime.datetime.now() if field == "mod_date" else default
 
     return metadata
 
 
-def fill_metadata(file_path, metadata):
-    try:
-        reader = PdfReader(file_path)
+def get_metadata(file_path, force_mode, manifest=None):
+    """Return a dictionary with the metadata of a PDF file.
+    Without force mode missing fields are asked for."""
 
-        if metadata['title'] == None:
-            if hasattr(reader.metadata, 'title') == f:
-                metadata['title'] = "Undefined"
+    if force_mode is True:
+        return get_record(file_path, manifest)
 
-        if metadata['author'] == None:
-            if hasattr(reader.metadata, 'author') == False:
-                metadata['author'] = "Undefined"
+    metadata = get_record(file_path, manifest, default=None)
 
-        if metadata['subject'] == None:
-            if hasattr(reader.metadata, 'description') == False:
-                metadata['subject'] = "Undefined"
+    for field in ["title", "author", "subject", "creator", "producer"]:
+        if metadata[field] is None:
+            metadata[field] = input(f'Insert metadata "{field.capitalize()}": ')
 
-        if metadata['creator'] == None:
-            if hasattr(reader.metadata, 'creator') == False:
-                metadata['creator'] = "Undefined"
+    if metadata["creation_date"] is None:
+        metadata["creation_date"] = datetime.datetime.now()
 
-        if metadata['producer'] == None:
-            if hasattr(reader.metadata, 'producer') == False:
-                metadata['producer'] = "Undefined"
+    return metadata
 
-        if metadata['creation_date'] == None:
-            if hasattr(reader.metadata, 'creation_date') == False:
-                metadata['creation_date'] = "Undefined"
 
-        if metadata['mod_date'] == None:
-            metadata['mod_date'] = datetime.datetime.now()
+def fill_metadata(file_path, metadata):
+    """Fill missing metadata with metadata from pdf.
+    If no metadata to fill is found 'Undefined' is used."""
 
-    except Exception as e:
-        print("Error: " + str(e))
+    for field, value in get_record(file_path).items():
+        if is_missing(metadata.get(field)):
+            metadata[field] = value
 
     return metadata
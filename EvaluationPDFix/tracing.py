@@ -0,0 +1,201 @@
+"""
+Records wall time, CPU time and peak RSS per pipeline stage, per document and per page.
+
+Tracing is off until enable() is called or PDFIX_TRACE is set. Every finished stage is appended
+to the JSON lines file as one record, and with a Chrome trace path also as a complete event that
+chrome://tracing and Perfetto open. The paths are kept in the environment, so worker processes
+append to the same files.
+
+Stages nest: a stage inherits the document and page of the stage it runs in, and its self time
+excludes the stages inside it. CPU time is that of the whole process, so it includes the threads
+of ONNX and the OCR models.
+
+    python tracing.py trace.jsonl
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows, peak RSS is not recorded
+
+
+TRACE_ENV = "PDFIX_TRACE"
+CHROME_ENV = "PDFIX_CHROME_TRACE"
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+RSS_UNIT = 1024 if sys.platform == "darwin" else 1
+
+# Stage of a DeepDoctection pipeline component, by the start of its name
+COMPONENT_STAGES = [("image_doctr", "ocr"), ("image_", "layout"), ("sub_image_", "table"), ("table_segment", "table"),
+                    ("text_extract_pdf", "pdf_text"), ("text_extract_", "ocr"),
+                    ("matching", "matching"), ("text_order", "reading_order")]
+
+_local = threading.local()
+
+
+def enable(path=None, chrome_path=None):
+    """Starts tracing to the JSON lines file path and/or to a Chrome trace file."""
+
+    disable()
+
+    if path:
+        os.environ[TRACE_ENV] = os.path.abspath(path)
+    if chrome_path:
+        os.environ[CHROME_ENV] = os.path.abspath(chrome_path)
+
+
+def disable():
+    os.environ.pop(TRACE_ENV, None)
+    os.environ.pop(CHROME_ENV, None)
+
+
+def enabled():
+    return TRACE_ENV in os.environ or CHROME_ENV in os.environ
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / RSS_UNIT / 1024
+
+
+def append(path, line, header=None):
+    # One write per record on a file opened for appending, so lines of parallel processes do not mix
+    with open(path, "a", encoding="utf-8") as file:
+        if header is not None and file.tell() == 0:
+            file.write(header)
+        file.write(line)
+
+
+def write(record):
+    path = os.environ.get(TRACE_ENV)
+    if path:
+        append(path, json.dumps(record, default=str) + "\n")
+
+    chrome_path = os.environ.get(CHROME_ENV)
+    if chrome_path:
+        args = {key: value for key, value in record.items() if key not in ("stage", "ts", "pid", "tid")}
+        event = {"name": record["stage"], "cat": record["parent"] or "pdfix", "ph": "X",
+                 "ts": round(record["ts"] * 1e6), "dur": round(record["wall_s"] * 1e6),
+                 "pid": record["pid"], "tid": record["tid"], "args": args}
+        # The JSON array format does not need the closing bracket, so events can be appended
+        append(chrome_path, json.dumps(event, default=str) + ",\n", header="[\n")
+
+
+@contextmanager
+def stage(name, document=None, page=None, **args):
+    """Records the wall time, CPU time and peak RSS of the code inside, when tracing is enabled.
+    Yields the dict of extra fields, so the stage can add to them while it runs."""
+
+    if not enabled():
+        yield args
+        return
+
+    stack = _local.__dict__.setdefault("stack", [])
+    parent = stack[-1] if stack else None
+
+    frame = {"name": name,
+             "document": document if document is not None else (parent["document"] if parent else None),
+             "page": page if page is not None else (parent["page"] if parent else None),
+             "children_wall": 0.0, "children_cpu": 0.0}
+    stack.append(frame)
+
+    rss = peak_rss_mb()
+    ts = time.time()
+    wall, cpu = time.perf_counter(), time.process_time()
+
+    try:
+        yield args
+
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        stack.pop()
+
+        if parent is not None:
+            parent["children_wall"] += wall
+            parent["children_cpu"] += cpu
+
+        peak = peak_rss_mb()
+        write({"stage": name,
+               "parent": parent["name"] if parent else None,
+               "document": os.path.basename(str(frame["document"])) if frame["document"] is not None else None,
+               "page": frame["page"],
+               "ts": ts,
+               "pid": os.getpid(),
+               "tid": threading.get_ident(),
+               "wall_s": wall,
+               "cpu_s": cpu,
+               "self_wall_s": wall - frame["children_wall"],
+               "self_cpu_s": cpu - frame["children_cpu"],
+               "peak_rss_mb": peak,
+               "rss_growth_mb": peak - rss if peak is not None else None,
+               **args})
+
+
+def component_stage(name):
+    for prefix, stage_name in COMPONENT_STAGES:
+        if name.lower().startswith(prefix):
+            return stage_name
+    return name
+
+
+def traced(function, name, **args):
+    def wrapper(*a, **kw):
+        with stage(name, **args):
+            return function(*a, **kw)
+    return wrapper
+
+
+def instrument(pipe):
+    """Wraps every component of a DeepDoctection pipeline in a stage named after what it does
+    (layout, ocr, pdf_text, ...). The components serve one page at a time, so every record is one page."""
+
+    for component in getattr(pipe, "pipe_component_list", []):
+        name = getattr(component, "name", type(component).__name__)
+        component.serve = traced(component.serve, component_stage(name), component=name)
+
+    return pipe
+
+
+def summarize(path):
+    """Returns the totals per stage of a JSON lines trace, sorted on self CPU time."""
+
+    totals = {}
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut off by an interrupted run
+
+            total = totals.setdefault(record["stage"], {"count": 0, "wall_s": 0.0, "self_wall_s": 0.0,
+                                                        "self_cpu_s": 0.0, "peak_rss_mb": 0.0})
+            total["count"] += 1
+            total["wall_s"] += record["wall_s"]
+            total["self_wall_s"] += record["self_wall_s"]
+            total["self_cpu_s"] += record["self_cpu_s"]
+            total["peak_rss_mb"] = max(total["peak_rss_mb"], record["peak_rss_mb"] or 0.0)
+
+    return sorted(totals.items(), key=lambda item: -item[1]["self_cpu_s"])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prints the time and memory per stage of a trace.')
+    parser.add_argument('trace', type=str, help='JSON lines trace written with --trace.')
+    args = parser.parse_args()
+
+    totals = summarize(args.trace)
+    cpu = sum(total["self_cpu_s"] for _, total in totals) or 1.0
+
+    print(f"{'STAGE':<16} | {'COUNT':>7} | {'WALL S':>9} | {'SELF WALL S':>11} | {'SELF CPU H':>10} | {'CPU %':>5} | {'PEAK RSS MB':>11}")
+    for name, total in totals:
+        print(f"{name:<16} | {total['count']:7d} | {total['wall_s']:9.1f} | {total['self_wall_s']:11.1f} | "
+              f"{total['self_cpu_s'] / 3600:10.3f} | {100 * total['self_cpu_s'] / cpu:5.1f} | {total['peak_rss_mb']:11.0f}")
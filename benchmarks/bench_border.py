@@ -0,0 +1,62 @@
+"""
+Check and benchmark of the border marking of the pdftotext token stream: the window scan of
+border_flags_loop against the prefix sum of border_flags. The flags are first compared on random
+token streams for n = 1..8, including empty streams and streams without empty lines.
+
+Run from the repository root: python benchmarks/bench_border.py
+"""
+import sys
+import timeit
+import numpy as np
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "evaluation"))
+from PDFair.eval import border_flags
+
+
+def border_flags_loop(line, n=4):
+    """Reference implementation of border_flags: the window scan per token that eval.py used before."""
+    line = list(line)
+    border = [0] * len(line)
+
+    for i in range(len(line)):
+        if i != len(line) - 1 and (line[i + 1] - line[i]) > 1:
+            border[i] = 1
+        if i != 0 and (line[i] - line[i - 1]) > 1:
+            border[i] = 1
+
+    for i in range(len(line)):
+        if border[i]:
+            continue
+        if any(True if b == 1 else False for b in border[i:i + n - 1]):
+            border[i] = 2
+        if any(True if b == 1 else False for b in border[max(0, i - n + 2):i]):
+            border[i] = 2
+
+    return np.array(border, dtype=np.int8)
+
+
+def random_lines(tokens, rng, gap=0.1):
+    """Returns increasing line numbers, with an empty line after a fraction gap of the lines."""
+    steps = rng.choice([0, 0, 0, 1, 2, 3], size=tokens, p=[0.3, 0.3, 0.3 - gap, 0.1, gap / 2, gap / 2])
+    return np.cumsum(steps)
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+
+    for _ in range(3000):
+        line = random_lines(int(rng.integers(0, 40)), rng, gap=float(rng.choice([0.0, 0.05, 0.3])))
+        for n in range(1, 9):
+            assert np.array_equal(border_flags_loop(line, n), border_flags(line, n)), (line, n)
+    print("border_flags matches border_flags_loop on 3000 random streams for n = 1..8")
+
+    print(f"{'tokens':>7} | {'loop (ms)':>10} | {'prefix sum (ms)':>15} | {'speedup':>7}")
+    for tokens in [100, 1000, 10000, 100000]:
+        line = random_lines(tokens, rng)
+
+        number = max(1, 20000 // tokens)
+        loop = min(timeit.repeat(lambda: border_flags_loop(line, 4), number=number, repeat=3)) / number
+        vectorized = min(timeit.repeat(lambda: border_flags(line, 4), number=number, repeat=3)) / number
+
+        print(f"{tokens:7d} | {loop * 1000:10.3f} | {vectorized * 1000:15.3f} | {loop / vectorized:6.1f}x")
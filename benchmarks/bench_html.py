@@ -0,0 +1,82 @@
+"""
+Benchmark of the accessible HTML output: the BeautifulSoup tree of build_html, finished with prettify,
+against the streaming write_html, for synthetic documents with an increasing number of pages.
+Both produce the same pretty printed HTML, which is checked before timing.
+
+Run from the repository root: python benchmarks/bench_html.py
+"""
+import io
+import sys
+import timeit
+import tracemalloc
+import numpy as np
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "EvaluationPDFix"))
+from accessibleHTML import build_html, write_html
+from cache import BoundingBox, CachedLayout, CachedPage
+
+
+METADATA = {
+    "title": "Beslisnota",
+    "author": "Ministerie",
+    "subject": "Benchmark",
+    "producer": "PDFix",
+    "creator": "Undefined",
+    "creation_date": "2024-01-01",
+    "mod_date": "2024-01-02 12:00:00",
+}
+
+
+def random_document(pages, rng, layouts_per_page=25):
+    """Returns analyzed pages with text, title and list layouts in shuffled reading order."""
+    document = []
+    for p in range(1, pages + 1):
+        order = rng.permutation(layouts_per_page)
+        layouts = [CachedLayout(rng.choice(["text", "text", "text", "title", "list"]),
+                                BoundingBox(0, 0, 100, 20), int(order[i]),
+                                " ".join(["woord & <tekst>"] * int(rng.integers(5, 60))))
+                   for i in range(layouts_per_page)]
+        document.append(CachedPage(layouts, 1654, 2339, "bench.pdf", "bench.pdf", p))
+    return document
+
+
+def soup(document):
+    return build_html(document, METADATA)
+
+
+def stream(document):
+    out = io.StringIO()
+    write_html(document, METADATA, out)
+    return out.getvalue()
+
+
+def peak_memory(function, document):
+    tracemalloc.start()
+    function(document)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    rows = []
+
+    for pages in [1, 10, 50, 200]:
+        document = random_document(pages, rng)
+
+        # Both emitters must write exactly the same HTML
+        assert soup(document) == stream(document)
+
+        number = max(1, 20 // pages)
+        soup_time = min(timeit.repeat(lambda: soup(document), number=number, repeat=3)) / number
+        stream_time = min(timeit.repeat(lambda: stream(document), number=number, repeat=3)) / number
+
+        rows.append((pages, soup_time, stream_time, peak_memory(soup, document), peak_memory(stream, document)))
+
+    # The emitters print progress, so the table is printed after all runs
+    print(f"{'pages':>5} | {'soup (ms)':>10} | {'stream (ms)':>11} | {'speedup':>7} | {'soup (MB)':>9} | {'stream (MB)':>11}")
+    for pages, soup_time, stream_time, soup_peak, stream_peak in rows:
+        print(f"{pages:5d} | {soup_time * 1000:10.1f} | {stream_time * 1000:11.1f} | {soup_time / stream_time:6.1f}x"
+              f" | {soup_peak / 1e6:9.1f} | {stream_peak / 1e6:11.1f}")
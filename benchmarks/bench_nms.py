@@ -0,0 +1,44 @@
+"""
+Microbenchmark of the YOLO box suppression: remove_overlapping_boxes against non_max_suppression,
+for an increasing number of candidate boxes. Both are greedy loops over the boxes. Up to NMS_MATRIX_MAX
+boxes non_max_suppression computes the N x N IoU matrix in one call and only reads the rows of kept
+boxes, which pays off for the few hundred candidates of a page. Above that it computes one IoU row
+per kept box like remove_overlapping_boxes, so the two are about equally fast there.
+
+Run from the repository root: python benchmarks/bench_nms.py
+"""
+import sys
+import timeit
+import numpy as np
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "evaluation"))
+from YOLO.YOLO import remove_overlapping_boxes, non_max_suppression
+
+
+def random_boxes(n, rng, page=(1654, 2339)):
+    """Returns n random (x1, y1, x2, y2, conf, cls) header candidates on an A4 page at 200 dpi."""
+    x1 = rng.uniform(0, page[0] * 0.8, n)
+    y1 = rng.uniform(0, page[1] * 0.9, n)
+    w = rng.uniform(50, page[0] * 0.6, n)
+    h = rng.uniform(10, 120, n)
+    conf = rng.uniform(0.25, 1.0, n)
+    return np.stack([x1, y1, np.minimum(x1 + w, page[0]), np.minimum(y1 + h, page[1]),
+                     conf, np.zeros(n)], axis=1).astype(np.float32)
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+
+    print(f"{'boxes':>6} | {'loop (ms)':>10} | {'nms (ms)':>15} | {'speedup':>7}")
+    for n in [10, 30, 100, 300, 1000, 3000]:
+        boxes = random_boxes(n, rng)
+
+        # Both routines must keep exactly the same boxes
+        assert np.array_equal(remove_overlapping_boxes(boxes), non_max_suppression(boxes))
+
+        number = max(1, 3000 // n)
+        loop = min(timeit.repeat(lambda: remove_overlapping_boxes(boxes), number=number, repeat=3)) / number
+        nms = min(timeit.repeat(lambda: non_max_suppression(boxes), number=number, repeat=3)) / number
+
+        print(f"{n:6d} | {loop * 1000:10.3f} | {nms * 1000:15.3f} | {loop / nms:6.1f}x")
@@ -0,0 +1,508 @@
+"""
+Benchmark suite of the PDFix and PDFair pipelines on a fixed corpus: synthetic PDFs generated with
+ReportLab from a fixed seed, so it runs offline, or the first n files of a directory such as
+BeslisnotaPDFs. Every scenario runs end to end or as a single stage, in its own process, so models
+loaded and memory used by one scenario do not leak into the next. The first document is run once
+before timing, so model loading is reported as warm-up instead of as latency.
+
+For every scenario the pages per second, the latency percentiles per document (or per page for the
+page stages) and the peak RSS of its process are reported. With --baseline the results are compared
+against an earlier run, a scenario that is slower or uses more memory than the tolerance allows, or that
+no longer produces numbers, is a regression and the exit code is 1.
+
+Run from the repository root:
+    python benchmarks/bench_pipeline.py --save-baseline benchmarks/baseline.json
+    python benchmarks/bench_pipeline.py --baseline benchmarks/baseline.json
+    python benchmarks/bench_pipeline.py --pdf-dir evaluation/BeslisnotaPDFs -n 20 --only "pdfair.*"
+"""
+import io
+import os
+import sys
+import json
+import time
+import glob
+import fnmatch
+import hashlib
+import argparse
+import platform
+import tempfile
+import contextlib
+import multiprocessing
+import numpy as np
+import importlib.metadata
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT / "EvaluationPDFix"))
+sys.path.append(str(ROOT / "evaluation"))
+
+# Documents of the synthetic corpus: (name, pages)
+CORPUS = [("memo", 1), ("brief", 2), ("nota-a", 3), ("nota-b", 5), ("nota-c", 8), ("besluit", 13), ("rapport", 21)]
+
+WORDS = ("de het een van en in is dat op te voor met niet zijn aan door ook om bij als nog maar over naar uit "
+         "minister ministerie besluit nota beslisnota openbaarmaking document verzoek advies kamer brief wet "
+         "overheid beleid gemeente provincie informatie toelichting beoordeling voorstel financiering").split()
+
+PERCENTILES = (50, 90, 99)
+
+
+def sentence(rng, n):
+    words = rng.choice(WORDS, n).tolist()
+    return " ".join(words).capitalize() + "."
+
+
+def synthetic_pdf(path, pages, rng):
+    """Writes a born-digital beslisnota lookalike: a running header and footer, headings, paragraphs and lists."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    width, height = A4
+    # invariant leaves out the creation date and document ID, so the same seed gives the same bytes
+    c = canvas.Canvas(str(path), pagesize=A4, invariant=1)
+    c.setTitle(f"Beslisnota {path.stem}")
+
+    for p in range(1, pages + 1):
+        c.setFont("Helvetica", 8)
+        c.drawString(56, height - 40, f"Ministerie van Benchmarks | Beslisnota {path.stem}")
+        c.drawRightString(width - 56, 30, f"Pagina {p} van {pages}")
+
+        y = height - 90
+        while y > 120:
+            kind = rng.choice(["heading", "paragraph", "paragraph", "list"])
+
+            if kind == "heading":
+                c.setFont("Helvetica-Bold", 13)
+                c.drawString(56, y, sentence(rng, int(rng.integers(2, 6)))[:-1])
+                y -= 24
+                continue
+
+            c.setFont("Helvetica", 10)
+            lines = int(rng.integers(2, 7))
+            for i in range(lines):
+                text = sentence(rng, int(rng.integers(9, 14)))
+                c.drawString(72 if kind == "list" else 56, y, ("- " if kind == "list" else "") + text)
+                y -= 14
+            y -= 10
+
+        c.showPage()
+
+    c.save()
+
+
+def synthetic_corpus(directory, seed=0):
+    """Returns the paths of the synthetic corpus, generating the documents that do not exist yet."""
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+
+    for i, (name, pages) in enumerate(CORPUS):
+        path = directory / f"{name}.pdf"
+        if not path.exists():
+            synthetic_pdf(path, pages, np.random.default_rng([seed, i]))
+        paths.append(str(path))
+
+    return paths
+
+
+def fingerprint(paths):
+    """Hash of the corpus files, results are only comparable on the same corpus."""
+    sha = hashlib.sha256()
+    for path in paths:
+        sha.update(os.path.basename(path).encode("utf-8"))
+        sha.update(Path(path).read_bytes())
+    return sha.hexdigest()[:16]
+
+
+class Timer:
+    """Collects (pages, seconds) of every timed unit, a document or a page."""
+
+    def __init__(self):
+        self.units = []
+
+    @contextlib.contextmanager
+    def measure(self, pages=1):
+        unit = {"pages": pages}
+        start = time.perf_counter()
+        yield unit
+        self.units.append((unit["pages"], time.perf_counter() - start))
+
+
+def counted(pages, unit):
+    """Passes the analyzed pages through while counting them in unit."""
+    unit["pages"] = 0
+    for page in pages:
+        unit["pages"] += 1
+        yield page
+
+
+def record(path):
+    from metadata import get_record
+
+    metadata = get_record(path)
+    metadata["producer"] = "PDFix"
+    return metadata
+
+
+# End to end
+
+def pdfix_process_file(path, tmp, timer):
+    from PDFix import process_file
+
+    with timer.measure() as unit:
+        unit["pages"] = process_file(path, os.path.join(tmp, "out.pdf"), force_mode=True, use_cache=False)
+
+
+def html_end_to_end(path, tmp, timer):
+    from accessibleHTML import init_analyzer, write_html
+
+    with timer.measure() as unit:
+        write_html(counted(init_analyzer(path, use_cache=False), unit), record(path), io.StringIO())
+
+
+def pdfair_pages(path, tmp, timer):
+    from PDFair.PDFair import Pdf
+
+    with timer.measure() as unit:
+        pdf = Pdf(path, use_cache=False)
+        pdf.pdf2doc()
+        pdf.detect_headers(force=True)
+        for page in pdf.pages:
+            page.doc2md(skip_headers=True)
+        unit["pages"] = len(pdf.pages)
+
+
+def page_eval(page, n=4):
+    from PDFair.eval import PageEval
+
+    evaluation = PageEval(page)
+    evaluation.pdf2txt()
+    evaluation.ddt_ngrams(n)
+    evaluation.ptt_ngrams(n)
+    evaluation.compare_ngrams()
+    evaluation.ptt.ptttoken_border(n)
+    return evaluation.metrics(n)
+
+
+def pdfair_evaluate(path, tmp, timer):
+    from PDFair.PDFair import Pdf
+
+    with timer.measure() as unit:
+        pdf = Pdf(path, use_cache=False)
+        pdf.pdf2doc()
+        pdf.detect_headers(force=True)
+        for page in pdf.pages:
+            page.doc2md(skip_headers=True)
+            page_eval(page)
+        unit["pages"] = len(pdf.pages)
+
+
+# Single stages, the analysis they start from is read from the cache outside the timed part
+
+def analyzed(path):
+    from createTaggedPDF import initAnalyzer
+    return list(initAnalyzer(path, use_cache=True))
+
+
+def analyzed_pdf(path, markdown=False):
+    from PDFair.PDFair import Pdf
+
+    pdf = Pdf(path, use_cache=True)
+    pdf.pdf2doc()
+    if markdown:
+        pdf.detect_headers()
+        for page in pdf.pages:
+            page.doc2md(skip_headers=True)
+    return pdf
+
+
+def pdfix_metadata(path, tmp, timer):
+    import metadata
+
+    # The Info dict is cached per process, every document is read cold
+    metadata._read_info.cache_clear()
+    with timer.measure(0):
+        metadata.get_metadata(path, True)
+
+
+def pdfix_analyze(path, tmp, timer):
+    from createTaggedPDF import initAnalyzer
+
+    with timer.measure() as unit:
+        unit["pages"] = len(list(initAnalyzer(path, use_cache=False)))
+
+
+def pdfix_rml(path, tmp, timer):
+    from createTaggedPDF import create_rml
+
+    pages, metadata = analyzed(path), record(path)
+    with timer.measure(len(pages)):
+        create_rml(pages, metadata, "out.pdf")
+
+
+def pdfix_render(path, tmp, timer):
+    from createTaggedPDF import create_rml, create_tagged_pdf
+
+    pages = analyzed(path)
+    rml = create_rml(pages, record(path), "out.pdf")
+    with timer.measure(len(pages)):
+        create_tagged_pdf(rml, os.path.join(tmp, "out.pdf"))
+
+
+def html_build_html(path, tmp, timer):
+    from accessibleHTML import build_html
+
+    pages, metadata = analyzed(path), record(path)
+    with timer.measure(len(pages)):
+        build_html(pages, metadata)
+
+
+def html_write_html(path, tmp, timer):
+    from accessibleHTML import write_html
+
+    pages, metadata = analyzed(path), record(path)
+    with timer.measure(len(pages)):
+        write_html(pages, metadata, io.StringIO())
+
+
+def pdfair_pdf2doc(path, tmp, timer):
+    from PDFair.PDFair import Pdf
+
+    with timer.measure() as unit:
+        pdf = Pdf(path, use_cache=False)
+        pdf.pdf2doc()
+        unit["pages"] = len(pdf.pages)
+
+
+def pdfair_detect_header(path, tmp, timer):
+    # Cached pages have no bitmap, so this includes rasterizing the pages for the header model
+    pdf = analyzed_pdf(path)
+    with timer.measure(len(pdf.pages)):
+        pdf.detect_headers(force=True)
+
+
+def pdfair_doc2md(path, tmp, timer):
+    pdf = analyzed_pdf(path)
+    pdf.detect_headers()
+    for page in pdf.pages:
+        with timer.measure():
+            page.doc2md(skip_headers=True)
+
+
+def pdfair_page_eval(path, tmp, timer):
+    pdf = analyzed_pdf(path, markdown=True)
+    for page in pdf.pages:
+        with timer.measure():
+            page_eval(page)
+
+
+SCENARIOS = {
+    "pdfix.process_file": pdfix_process_file,
+    "html.end_to_end": html_end_to_end,
+    "pdfair.pages": pdfair_pages,
+    "pdfair.evaluate": pdfair_evaluate,
+    "pdfix.metadata": pdfix_metadata,
+    "pdfix.analyze": pdfix_analyze,
+    "pdfix.rml": pdfix_rml,
+    "pdfix.render": pdfix_render,
+    "html.build_html": html_build_html,
+    "html.write_html": html_write_html,
+    "pdfair.pdf2doc": pdfair_pdf2doc,
+    "pdfair.detect_header": pdfair_detect_header,
+    "pdfair.doc2md": pdfair_doc2md,
+    "pdfair.page_eval": pdfair_page_eval,
+}
+
+
+def run_scenario(job):
+    """Runs one scenario over the corpus in a fresh process and returns its measurements."""
+    name, paths, repeat = job
+    scenario = SCENARIOS[name]
+
+    from tracing import peak_rss_mb
+
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        try:
+            start = time.perf_counter()
+            scenario(paths[0], tmp, Timer())
+            warmup = time.perf_counter() - start
+
+            timer = Timer()
+            for _ in range(repeat):
+                for path in paths:
+                    scenario(path, tmp, timer)
+
+        except ImportError as e:
+            return name, {"skipped": f"{type(e).__name__}: {str(e)}"}
+        except Exception as e:
+            return name, {"error": f"{type(e).__name__}: {str(e)}"}
+
+    if not timer.units:
+        return name, {"error": "nothing was measured"}
+
+    pages = sum(p for p, _ in timer.units)
+    seconds = sum(s for _, s in timer.units)
+    latencies = np.array([s for _, s in timer.units]) * 1000
+
+    result = {"units": len(timer.units),
+              "pages": pages,
+              "seconds": seconds,
+              "pages_per_s": pages / seconds if pages and seconds else None,
+              "warmup_s": warmup,
+              "peak_rss_mb": peak_rss_mb()}
+    for q, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES).tolist()):
+        result[f"p{q}_ms"] = value
+
+    return name, result
+
+
+def environment():
+    versions = {}
+    for package in ["numpy", "pypdf", "reportlab", "deepdoctection", "onnxruntime"]:
+        try:
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            versions[package] = None
+
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            **versions}
+
+
+def run(paths, names, repeat=1):
+    # Every scenario gets a fresh process and all share an empty analysis cache, without tracing
+    os.environ.pop("PDFIX_TRACE", None)
+    os.environ.pop("PDFIX_CHROME_TRACE", None)
+
+    context = multiprocessing.get_context("spawn")
+    scenarios = {}
+
+    with tempfile.TemporaryDirectory(prefix="pdfix-bench-cache-") as cache:
+        os.environ["PDFIX_CACHE_DIR"] = cache
+
+        for name in names:
+            with context.Pool(1) as pool:
+                name, result = pool.apply(run_scenario, ((name, paths, repeat),))
+            scenarios[name] = result
+            print(f"{name}: {describe(result)}", flush=True)
+
+    os.environ.pop("PDFIX_CACHE_DIR")
+    return scenarios
+
+
+def describe(result):
+    if "skipped" in result or "error" in result:
+        return result.get("skipped") or result.get("error")
+    return f"{result['pages']} pages in {result['seconds']:.2f}s"
+
+
+# Higher is better for pages per second, lower for everything else
+METRICS = [("pages_per_s", 1), ("p50_ms", -1), ("p90_ms", -1), ("peak_rss_mb", -1)]
+
+
+def compare(results, baseline, tolerance, patterns=("*",)):
+    """Prints the change of every metric against the baseline and returns the regressed scenarios.
+    A scenario the baseline has numbers for, that matches patterns but was not measured in this run
+    (missing, failed or skipped), is a regression as well."""
+    if results["corpus"]["fingerprint"] != baseline["corpus"]["fingerprint"]:
+        print("Warning: the baseline was measured on a different corpus")
+
+    regressions = []
+    print(f"{'scenario':<22} | {'metric':<11} | {'baseline':>10} | {'current':>10} | {'change':>7}")
+
+    for name, base in baseline["scenarios"].items():
+        if "pages_per_s" not in base or not any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+            continue
+
+        result = results["scenarios"].get(name)
+        if result is None or "pages_per_s" not in result:
+            regressions.append(f"{name} not measured")
+            print(f"{name:<22} | {describe(result) if result else 'missing from this run'}  REGRESSION")
+            continue
+
+        for metric, sign in METRICS:
+            if not base.get(metric) or result.get(metric) is None:
+                continue
+
+            change = result[metric] / base[metric] - 1
+            regressed = -sign * change > tolerance
+            if regressed:
+                regressions.append(f"{name} {metric}")
+
+            print(f"{name:<22} | {metric:<11} | {base[metric]:10.2f} | {result[metric]:10.2f} | "
+                  f"{100 * change:+6.1f}%{'  REGRESSION' if regressed else ''}")
+
+    return regressions
+
+
+def print_results(scenarios):
+    print(f"\n{'scenario':<22} | {'pages':>5} | {'pages/s':>8} | {'p50 ms':>8} | {'p90 ms':>8} | {'p99 ms':>8} | "
+          f"{'warm-up s':>9} | {'peak RSS MB':>11}")
+
+    for name, result in scenarios.items():
+        if "pages_per_s" not in result:
+            print(f"{name:<22} | {describe(result)}")
+            continue
+
+        rss = f"{result['peak_rss_mb']:11.0f}" if result["peak_rss_mb"] is not None else f"{'-':>11}"
+        pages_per_s = f"{result['pages_per_s']:8.2f}" if result["pages_per_s"] is not None else f"{'-':>8}"
+        print(f"{name:<22} | {result['pages']:5d} | {pages_per_s} | {result['p50_ms']:8.1f} | "
+              f"{result['p90_ms']:8.1f} | {result['p99_ms']:8.1f} | {result['warmup_s']:9.2f} | {rss}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the PDFix and PDFair pipelines on a fixed corpus.')
+    parser.add_argument('--pdf-dir', type=str, default=None,
+                        help='Benchmark the first n pdf files of this directory instead of the synthetic corpus.')
+    parser.add_argument('-n', type=int, default=10,
+                        help='Number of files taken from --pdf-dir, in sorted order.')
+    parser.add_argument('--corpus-dir', type=str, default=str(Path(tempfile.gettempdir()) / "pdfix-bench-corpus"),
+                        help='Directory the synthetic corpus is generated in.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the synthetic corpus.')
+    parser.add_argument('--only', type=str, default="*",
+                        help='Comma separated scenario names or patterns, e.g. "pdfair.*,html.build_html".')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Times every document is run after the warm-up.')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='Compare against the results in this JSON file.')
+    parser.add_argument('--save-baseline', type=str, default=None,
+                        help='Write the results as new baseline to this JSON file.')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='Relative change of a metric that counts as regression.')
+    args = parser.parse_args()
+
+    if args.pdf_dir:
+        paths = sorted(glob.glob(os.path.join(args.pdf_dir, '*.pdf')))[:args.n]
+        corpus = {"kind": "directory", "source": os.path.abspath(args.pdf_dir)}
+    else:
+        paths = synthetic_corpus(Path(args.corpus_dir) / f"seed{args.seed}", args.seed)
+        corpus = {"kind": "synthetic", "seed": args.seed}
+
+    if not paths:
+        sys.exit(f"No pdf files in {args.pdf_dir}")
+
+    patterns = [pattern.strip() for pattern in args.only.split(",")]
+    names = [name for name in SCENARIOS if any(fnmatch.fnmatch(name, pattern) for pattern in patterns)]
+
+    corpus.update({"documents": [os.path.basename(path) for path in paths], "fingerprint": fingerprint(paths)})
+    print(f"{len(paths)} documents (corpus {corpus['fingerprint']}), {len(names)} scenarios")
+
+    results = {"environment": environment(), "corpus": corpus, "repeat": args.repeat,
+               "scenarios": run(paths, names, args.repeat)}
+    print_results(results["scenarios"])
+
+    for path in [args.output, args.save_baseline]:
+        if path:
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+
+        print()
+        regressions = compare(results, baseline, args.tolerance, patterns)
+        if regressions:
+            print(f"\n{len(regressions)} regressions: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nNo regressions")
@@ -0,0 +1,138 @@
+"""
+Offline check of download.py against a local stand-in for open.overheid.nl: a threaded http.server
+that serves random PDF bytes under /documenten/<id>/pdf and /documenten/<id>/file, with one
+misbehaving document per case:
+
+    u0  served normally
+    u1  404 on /pdf, served on /file
+    u2  the connection drops after 100 kB on the first request, the rest is fetched with a Range request
+    u3  an interrupted earlier run left the first 50 kB in d3.pdf.part, continued with a Range request
+    u4  already downloaded before the log existed, adopted without a request
+    u5  an HTML error page with status 200 on both URLs, fails without leaving a file
+    u6  503 on the first request, retried
+    u7  404 on both URLs, fails without retrying
+
+A second run over the same output directory must not request the documents it already has.
+
+Run from the repository root: python benchmarks/check_download.py
+"""
+import os
+import sys
+import socket
+import tempfile
+import threading
+import pandas as pd
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "EvaluationPDFix"))
+import download
+
+DOCUMENTS = {f"u{i}": b"%PDF-1.4\n" + os.urandom(300000) + b"%%EOF" for i in range(8)}
+
+
+class StandIn(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests = []
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def empty(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        _, document, kind = self.path.strip("/").split("/")
+        with self.lock:
+            self.requests.append((document, kind, self.headers.get("Range")))
+            attempts = sum(1 for d, _, _ in self.requests if d == document)
+
+        if document == "u7" or (document == "u1" and kind == "pdf"):
+            return self.empty(404)
+        if document == "u6" and attempts == 1:
+            return self.empty(503)
+
+        if document == "u5":
+            body = b"<html><body>Document niet gevonden</body></html>"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        data, start = DOCUMENTS[document], 0
+        if self.headers.get("Range"):
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            if start >= len(data):
+                return self.empty(416)
+            self.send_response(206)
+        else:
+            self.send_response(200)
+
+        body = data[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        if document == "u2" and attempts == 1:
+            self.wfile.write(body[:100000])
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.close_connection = True
+            return
+
+        self.wfile.write(body)
+
+
+if __name__ == '__main__':
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Keep the Feather cache of the manifest out of the user's cache directory
+        download.manifest.MANIFEST_DIR = Path(tmp) / "manifests"
+
+        manifest_path = os.path.join(tmp, "manifest.csv")
+        pd.DataFrame({"id": [f"d{i}" for i in range(8)],
+                      "dc_source": [f"https://open.overheid.nl/documenten/u{i}/pdf" for i in range(8)]}) \
+            .to_csv(manifest_path, sep=";", index=False)
+
+        output_dir = os.path.join(tmp, "pdfs")
+        os.makedirs(output_dir)
+        with open(os.path.join(output_dir, "d3.pdf.part"), "wb") as file:
+            file.write(DOCUMENTS["u3"][:50000])
+        with open(os.path.join(output_dir, "d4.pdf"), "wb") as file:
+            file.write(DOCUMENTS["u4"])
+
+        failed = download.download(manifest_path, output_dir, workers=4, base_url=base_url)
+        assert sorted(failed) == ["d5", "d7"], failed
+
+        for i in [0, 1, 2, 3, 4, 6]:
+            with open(os.path.join(output_dir, f"d{i}.pdf"), "rb") as file:
+                assert file.read() == DOCUMENTS[f"u{i}"], f"d{i}.pdf differs from the served document"
+
+        assert sorted(os.listdir(output_dir)) == ["d0.pdf", "d1.pdf", "d2.pdf", "d3.pdf", "d4.pdf", "d6.pdf",
+                                                  "downloads.jsonl"], os.listdir(output_dir)
+
+        requests = {}
+        for document, kind, byte_range in StandIn.requests:
+            requests.setdefault(document, []).append((kind, byte_range))
+
+        assert "u4" not in requests, requests["u4"]
+        assert requests["u1"] == [("pdf", None), ("file", None)], requests["u1"]
+        # Only whole chunks of the dropped body are on disk, the Range request continues after the last one
+        assert len(requests["u2"]) == 2 and requests["u2"][1][1] not in (None, "bytes=0-"), requests["u2"]
+        assert requests["u3"] == [("pdf", "bytes=50000-")], requests["u3"]
+        assert requests["u6"] == [("pdf", None), ("pdf", None)], requests["u6"]
+        assert requests["u7"] == [("pdf", None), ("file", None)], requests["u7"]
+
+        StandIn.requests.clear()
+        failed = download.download(manifest_path, output_dir, workers=4, base_url=base_url)
+        assert [document for document, _, _ in StandIn.requests if document not in ("u5", "u7")] == [], \
+            StandIn.requests
+
+    server.shutdown()
+    print("download.py passed all stand-in server cases")
@@ -0,0 +1,117 @@
+"""
+Check of merge_tagged_pdfs on synthetic tagged parts, as written by create_tagged_pdf_parallel.
+Every part has two pages, one Document element with an H1 and two P elements, a ParentTree keyed by
+StructParents, a RoleMap and the Lang, MarkInfo and Info of the first part. The merged file must keep
+one structure tree over all pages:
+
+    - one StructTreeRoot, with one Document element holding the elements of all parts in order
+    - the /P of every element points to its new parent, the /Pg to the page it was on
+    - the ParentTree keys and the StructParents of the pages are shifted per part and still match
+    - RoleMap, Lang, MarkInfo and the Info dict are taken from the first part
+
+Run from the repository root: python benchmarks/check_merge.py
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, BooleanObject, DictionaryObject, NameObject, NumberObject, TextStringObject
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "EvaluationPDFix"))
+from createTaggedPDF import add_object, root_object, merge_tagged_pdfs
+
+PARTS = ["a", "b", "c"]
+
+
+def element(writer, structure, parent, page, mcid, tag):
+    return add_object(writer, DictionaryObject({
+        NameObject("/Type"): NameObject("/StructElem"),
+        NameObject("/S"): NameObject(structure),
+        NameObject("/P"): parent,
+        NameObject("/Pg"): page,
+        NameObject("/K"): NumberObject(mcid),
+        NameObject("/T"): TextStringObject(tag),
+    }))
+
+
+def tagged_part(path, tag):
+    """Writes a two page tagged PDF, its elements are titled with tag."""
+    writer = PdfWriter()
+    for _ in range(2):
+        writer.add_blank_page(595, 842)
+    pages = [page.indirect_reference for page in writer.pages]
+
+    struct_root = add_object(writer, DictionaryObject({NameObject("/Type"): NameObject("/StructTreeRoot")}))
+    document = add_object(writer, DictionaryObject({NameObject("/Type"): NameObject("/StructElem"),
+                                                    NameObject("/S"): NameObject("/Document"),
+                                                    NameObject("/P"): struct_root}))
+
+    heading = element(writer, "/H1", document, pages[0], 0, tag)
+    first = element(writer, "/P", document, pages[0], 1, tag)
+    second = element(writer, "/P", document, pages[1], 0, tag)
+    document.get_object()[NameObject("/K")] = ArrayObject([heading, first, second])
+
+    struct_root.get_object().update({
+        NameObject("/K"): document,
+        NameObject("/ParentTree"): add_object(writer, DictionaryObject({NameObject("/Nums"): ArrayObject([
+            NumberObject(0), ArrayObject([heading, first]), NumberObject(1), ArrayObject([second])])})),
+        NameObject("/RoleMap"): DictionaryObject({NameObject(f"/h1{tag}"): NameObject("/H1")}),
+    })
+    for i, page in enumerate(writer.pages):
+        page[NameObject("/StructParents")] = NumberObject(i)
+
+    catalog = root_object(writer)
+    catalog[NameObject("/StructTreeRoot")] = struct_root
+    catalog[NameObject("/Lang")] = TextStringObject(f"nl-{tag}")
+    catalog[NameObject("/MarkInfo")] = DictionaryObject({NameObject("/Marked"): BooleanObject(True)})
+    writer.add_metadata({"/Title": f"Titel {tag}", "/Author": "Auteur"})
+
+    with open(path, "wb") as file:
+        writer.write(file)
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp:
+        part_paths = [os.path.join(tmp, f"part{tag}.pdf") for tag in PARTS]
+        for path, tag in zip(part_paths, PARTS):
+            tagged_part(path, tag)
+
+        output_path = os.path.join(tmp, "merged.pdf")
+        merge_tagged_pdfs(part_paths, output_path)
+
+        reader = PdfReader(output_path)
+        with open(output_path, "rb") as file:
+            data = file.read()
+
+    catalog = reader.trailer["/Root"]
+    assert len(reader.pages) == 2 * len(PARTS), len(reader.pages)
+    assert catalog["/Lang"] == "nl-a" and catalog["/MarkInfo"]["/Marked"], (catalog["/Lang"], catalog["/MarkInfo"])
+    assert reader.metadata.title == "Titel a", reader.metadata
+    # The StructTreeRoots of the parts are not copied along with their pages
+    assert data.count(b"/StructTreeRoot") == 2, data.count(b"/StructTreeRoot")
+
+    struct_root = catalog["/StructTreeRoot"]
+    assert list(struct_root["/RoleMap"]) == ["/h1a"], struct_root["/RoleMap"]
+    assert len(struct_root["/K"]) == 1, struct_root["/K"]
+
+    document = struct_root["/K"][0].get_object()
+    assert document["/S"] == "/Document", document["/S"]
+    assert document.raw_get("/P").idnum == struct_root.indirect_reference.idnum
+
+    page_index = {page.indirect_reference.idnum: i for i, page in enumerate(reader.pages)}
+    elements = [kid.get_object() for kid in document["/K"]]
+    assert [(e["/S"], e["/T"], page_index[e.raw_get("/Pg").idnum]) for e in elements] == \
+        [(s, tag, 2 * p + page) for p, tag in enumerate(PARTS) for s, page in [("/H1", 0), ("/P", 0), ("/P", 1)]]
+    assert all(e.raw_get("/P").idnum == document.indirect_reference.idnum for e in elements)
+
+    # Every page finds the elements on it through its StructParents
+    nums = struct_root["/ParentTree"]["/Nums"]
+    parent_tree = {nums[i]: [kid.get_object() for kid in nums[i + 1]] for i in range(0, len(nums), 2)}
+    assert struct_root["/ParentTreeNextKey"] == len(parent_tree) == len(reader.pages)
+    for i, page in enumerate(reader.pages):
+        on_page = [e for e in elements if page_index[e.raw_get("/Pg").idnum] == i]
+        assert [e.indirect_reference.idnum for e in parent_tree[page["/StructParents"]]] == \
+            [e.indirect_reference.idnum for e in on_page], i
+
+    print(f"merge_tagged_pdfs kept one structure tree over {len(PARTS)} parts")
@@ -0,0 +1,65 @@
+"""
+Check of the vectorized MinHash in temp/evaluation.py against datasketch: the signatures must equal
+those of get_minhash (the datasketch MinHash) for every sentence, including empty sentences and
+repeated words, and SentenceMatcher must pick the candidate a datasketch MinHashLSH query finds with
+the highest estimated similarity. A saved matcher must load back from the path it was saved to,
+with or without the .npz suffix.
+
+Run from the repository root: python benchmarks/check_minhash.py
+"""
+import os
+import sys
+import tempfile
+import numpy as np
+from pathlib import Path
+from datasketch import MinHash, MinHashLSH
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "temp"))
+from evaluation import NUM_PERM, get_minhash, signatures, SentenceMatcher
+
+WORDS = [f"w{i}" for i in range(300)] + ["één", "beslisnota", "Kamerbrief"]
+
+
+def sentence(rng):
+    return " ".join(rng.choice(WORDS, int(rng.integers(0, 13))).tolist())
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+
+    reference = [sentence(rng) for _ in range(500)] + ["", "w1 w1 w1", "w1"]
+    reference_signatures = signatures(reference)
+    for i, text in enumerate(reference):
+        assert np.array_equal(get_minhash(text).hashvalues, reference_signatures[i]), (i, text)
+    print(f"signatures equal get_minhash for {len(reference)} sentences")
+
+    # Queries: copies, copies without their last word and unrelated sentences
+    queries = []
+    for text in reference[:400]:
+        kind = rng.integers(0, 3)
+        queries.append(text if kind == 0 else " ".join(text.split()[:-1]) if kind == 1 else sentence(rng))
+    query_signatures = signatures(queries)
+
+    lsh = MinHashLSH(threshold=0.7, num_perm=NUM_PERM)
+    for i, text in enumerate(reference):
+        if text.split():
+            lsh.insert(i, MinHash(num_perm=NUM_PERM, hashvalues=reference_signatures[i]))
+
+    matcher = SentenceMatcher(reference)
+    matches = matcher.match(queries)
+
+    for i, text in enumerate(queries):
+        candidates = lsh.query(MinHash(num_perm=NUM_PERM, hashvalues=query_signatures[i])) if text.split() else []
+        if not candidates:
+            assert i not in matches, (i, text)
+            continue
+        best = min(candidates, key=lambda j: (-(query_signatures[i] == reference_signatures[j]).mean(), j))
+        assert matches[i] == best, (i, matches[i], best)
+    print(f"SentenceMatcher matches the best MinHashLSH candidate for {len(queries)} queries ({len(matches)} matched)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ["matcher", "matcher.npz"]:
+            path = os.path.join(tmp, name)
+            matcher.save(path)
+            assert SentenceMatcher.load(path).match(queries) == matches, name
+    print("a saved SentenceMatcher loads back with and without the .npz suffix")
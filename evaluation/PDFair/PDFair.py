@@ -1,20 +1,32 @@
-import deepdoctection as dd
 from pathlib import Path
 import re
-from YOLO.YOLO import load_and_process_pdf, run_onnx_inference, visualize_boxes
+import sys
+import numpy as np
+from YOLO.YOLO import run_onnx_inference, run_onnx_inference_batch
+from PDFair.images import PageImages, STREAM_CHUNK
+
+# The analyzer registry lives next to PDFix so both tools share the same warm models
+sys.path.append(str(Path(__file__).resolve().parents[2] / "EvaluationPDFix"))
+from analyzer import analyze, config_key, triage
+from layout_table import LayoutTable
+import cache
+import tracing
 
 config_overwrite = ["LANGUAGE='nld'",
                     "TEXT_ORDERING.INCLUDE_RESIDUAL_TEXT_CONTAINER=True",
                     "USE_PDF_MINER=True"]
-analyzer = dd.get_dd_analyzer(config_overwrite=config_overwrite)
 
 
-def scale_bbox(bb, original_dpi=72, rendered_dpi=108):
-    s = original_dpi / rendered_dpi
-    return [bb.ulx * s, bb.uly * s, bb.lrx * s, bb.lry * s]
+def points_in_boxes(x, y, boxes):
+    """Returns for every point whether it lies inside (or on the edge of) any of the (k, 4) boxes,
+    tested for all points and boxes at once."""
+    boxes = np.asarray(boxes, dtype=np.float64)
+    if not len(boxes):
+        return np.zeros(len(x), dtype=bool)
 
-def calc_centroid(bb):
-    return ((bb[0] + bb[2]) / 2, (bb[1] + bb[3]) / 2)
+    inside = ((boxes[:, 0] <= x[:, None]) & (x[:, None] <= boxes[:, 2]) &
+              (boxes[:, 1] <= y[:, None]) & (y[:, None] <= boxes[:, 3]))
+    return inside.any(axis=1)
 
 
 class Page:
@@ -37,37 +49,122 @@ class Page:
             return f"## {layout.text}"
 
     def doc2md(self, skip_headers = False):
+        with tracing.stage("markdown", page=self.p):
+            self.__build_md(skip_headers)
+
+    def __build_md(self, skip_headers):
+        table = LayoutTable(self.doc)
+        layouts = self.doc.layouts
+
         if skip_headers:
-            layouts = (l for l in sorted(self.doc.layouts, key=lambda x: x.bounding_box.uly) if not l.is_header)
-            self.md = "\n".join(self.__doc2md_helper(layout) for layout in layouts)
-            self.header = "\n\n".join(layout.text for layout in self.doc.layouts if layout.is_header)
+            order = table.top_down()
+            order = order[~table.is_header[order]]
+            self.md = "\n".join(self.__doc2md_helper(layouts[i]) for i in order.tolist())
+            self.header = "\n\n".join(layouts[i].text for i in np.flatnonzero(table.is_header).tolist())
         else:
-            layouts = sorted(self.doc.layouts, key=lambda x: x.reading_order)
-            self.md = "\n".join(self.__doc2md_helper(layout) for layout in layouts)
+            self.md = "\n".join(self.__doc2md_helper(layouts[i]) for i in table.order().tolist())
         
 
-    def detect_header(self):
-        images = load_and_process_pdf(self.pdf.path, page=self.p)
-        output_boxes = run_onnx_inference(images[0])
+    def has_header_flags(self):
+        # Header flags restored from the analysis cache are reused as is
+        return bool(self.doc.layouts) and all(getattr(l, "is_header", None) is not None for l in self.doc.layouts)
+
+    def detect_header(self, force=False, store=True):
+        """Returns the header flags of the layouts, None when the cached flags were reused."""
+        if not force and self.has_header_flags():
+            return None
+
+        with tracing.stage("header_detection", page=self.p):
+            with tracing.stage("rasterize"):
+                image, bgr = self.pdf.images.get(self.p)
+            return self.set_header(run_onnx_inference(image, bgr=bgr), image, store)
 
-        for l in self.doc.layouts:
-            l.is_header = False
-            bb = scale_bbox(l.bounding_box)
-            x, y = calc_centroid(bb)
-            for ob in output_boxes:
-                if (ob[0] <= x <= ob[2] and ob[1] <= y <= ob[3]):
-                    l.is_header = True
+    def set_header(self, output_boxes, image, store=True):
+        # Layout boxes are in DeepDoctection page pixels, the YOLO boxes in pixels of the shared bitmap
+        scale = image.shape[1] / self.doc.width
+
+        # A layout is a header when its centroid lies in a detected header box
+        x, y = LayoutTable(self.doc).centroids(scale)
+        flags = points_in_boxes(x, y, output_boxes).tolist()
+
+        for l, flag in zip(self.doc.layouts, flags):
+            l.is_header = flag
+
+        if store:
+            cache.store_headers(self.pdf.cache_key, self.doc.page_number, flags)
+        return flags
+
+    def release(self):
+        # Drop the page bitmap once header detection is done, the layouts and text stay available
+        self.pdf.images.release(self.p)
+        if hasattr(self.doc, "clear_image"):
+            self.doc.clear_image()
 
 
 class Pdf:
-    def __init__(self, path):
+    def __init__(self, path, config=config_overwrite, use_cache=True):
         self.path = path
+        self.config = config
+        self.use_cache = use_cache
+        self.cache_key = None
+        self.analysis_config = None
+        self.images = PageImages(path)
         self.pages = None
 
+    def triage(self):
+        # Decided once per document, born-digital documents are analyzed without OCR
+        if self.analysis_config is None:
+            self.analysis_config = triage(self.path, self.config)
+        return self.analysis_config
+
     def pdf2doc(self):
-        df = analyzer.analyze(path=Path.cwd() / self.path)
-        pages = iter(df)
+        config = self.triage()
+        self.cache_key = cache.cache_key(Path.cwd() / self.path, config_key(config))
+        pages = analyze(self.path, config, self.use_cache, self.cache_key)
         self.pages = [Page(self, i+1, doc) for i, doc in enumerate(pages)]
 
+        # Reuse the bitmaps DeepDoctection rendered (BGR), pages read from the cache have none
+        for page in self.pages:
+            self.images.add(page.p, getattr(page.doc, "image", None), bgr=True)
+
+    def iter_pages(self, skip_headers=True):
+        """Yields the pages one at a time, analyzed, header-detected and converted to markdown.
+        Pages are not kept on the Pdf and their bitmap is dropped before the next page is analyzed,
+        so memory is bounded by one page instead of the document length."""
+        config = self.triage()
+        self.cache_key = cache.cache_key(Path.cwd() / self.path, config_key(config))
+        self.images.chunk = STREAM_CHUNK
+        flags = {}
+
+        for i, doc in enumerate(analyze(self.path, config, self.use_cache, self.cache_key)):
+            page = Page(self, i+1, doc)
+            self.images.add(page.p, getattr(doc, "image", None), bgr=True)
+
+            with tracing.stage("page", document=self.path, page=page.p):
+                detected = page.detect_header(store=False)
+                if detected is not None:
+                    flags[doc.page_number] = detected
+                page.doc2md(skip_headers=skip_headers)
+                page.release()
+
+            yield page
+
+        # analyze writes the cache entry once its pages are exhausted, the flags are added to it in one rewrite
+        cache.store_all_headers(self.cache_key, flags)
+
+    def detect_headers(self, force=False):
+        """Runs header detection for all pages of the document in batched model calls."""
+        pages = [page for page in self.pages if force or not page.has_header_flags()]
+
+        with tracing.stage("header_detection", document=self.path, pages=len(pages)):
+            with tracing.stage("rasterize"):
+                images = [self.images.get(page.p) for page in pages]
+            output_boxes = run_onnx_inference_batch([image for image, _ in images], bgr=[bgr for _, bgr in images])
+
+            # The cache entry is rewritten once for the whole document instead of once per page
+            flags = {page.doc.page_number: page.set_header(boxes, image, store=False)
+                     for page, (image, _), boxes in zip(pages, images, output_boxes)}
+            cache.store_all_headers(self.cache_key, flags)
+
     
 
@@ -0,0 +1,294 @@
+"""
+Document level evaluation: the pdftotext token stream of a whole document is aligned against the
+token stream reconstructed by PDFair (header and markdown of every page) in one pass.
+
+The alignment is a patience diff: tokens that occur exactly once in both streams are anchors, the
+longest increasing subsequence of the anchors is kept and the gaps between them are aligned the same
+way. Tokens left over are classified with n-grams: text that occurs on both sides but outside the
+alignment is reordered, reconstructed text that repeats aligned text is duplicated, the rest is
+missing (pdftotext side) or extra (reconstruction side). Every span keeps its page numbers.
+"""
+import difflib
+from bisect import bisect_left
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from PDFair.eval import PageEval, Vocabulary, window_keys
+from PDFair.text import get_text
+
+# Status of the pdftotext tokens
+MATCHED, MISSING, REORDERED = 0, 1, 2
+# Status of the reconstructed tokens, besides MATCHED and REORDERED
+EXTRA, DUPLICATED = 3, 4
+
+KINDS = {MISSING: "missing", REORDERED: "reordered", EXTRA: "extra", DUPLICATED: "duplicated"}
+
+# Gaps without unique anchors up to this many token pairs are aligned with difflib
+DIFFLIB_LIMIT = 4096
+
+# Anchor lengths tried in turn, repetitive text has no unique single tokens but does have unique n-grams
+ANCHOR_LENGTHS = (1, 2, 4, 8, 16)
+
+
+def common_prefix(a, b):
+    m = min(len(a), len(b))
+    different = np.flatnonzero(a[:m] != b[:m])
+    return int(different[0]) if len(different) else m
+
+
+def unique_anchors(a, b, k=1):
+    """Returns the start positions in a and b of the k-token sequences that occur exactly once in both, sorted on a."""
+    if k > 1:
+        if min(len(a), len(b)) < k:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        # Number the k-token windows of both arrays together, so equal windows get equal keys
+        wa, wb = sliding_window_view(a, k), sliding_window_view(b, k)
+        _, keys = np.unique(np.concatenate([wa, wb]), axis=0, return_inverse=True)
+        keys = keys.reshape(-1)
+        a, b = keys[:len(wa)], keys[len(wa):]
+
+    ua, ia, ca = np.unique(a, return_index=True, return_counts=True)
+    ub, ib, cb = np.unique(b, return_index=True, return_counts=True)
+
+    _, xa, xb = np.intersect1d(ua[ca == 1], ub[cb == 1], assume_unique=True, return_indices=True)
+    pa, pb = ia[ca == 1][xa], ib[cb == 1][xb]
+
+    order = np.argsort(pa)
+    return pa[order], pb[order]
+
+
+def longest_increasing(values):
+    """Returns the indices of a longest strictly increasing subsequence of values."""
+    tails, tail_index = [], []
+    previous = [-1] * len(values)
+
+    for i, value in enumerate(values):
+        k = bisect_left(tails, value)
+        if k == len(tails):
+            tails.append(value)
+            tail_index.append(i)
+        else:
+            tails[k] = value
+            tail_index[k] = i
+        previous[i] = tail_index[k - 1] if k else -1
+
+    result = []
+    i = tail_index[-1] if tail_index else -1
+    while i != -1:
+        result.append(i)
+        i = previous[i]
+
+    return result[::-1]
+
+
+def align(a, b):
+    """Returns the positions (ia, ib) of the aligned tokens of two ID arrays, increasing in both."""
+    ia, ib = [], []
+    stack = [(0, len(a), 0, len(b))]
+
+    while stack:
+        a0, a1, b0, b1 = stack.pop()
+
+        # Equal text at the start and end of a range is aligned directly
+        k = common_prefix(a[a0:a1], b[b0:b1])
+        ia.append(np.arange(a0, a0 + k))
+        ib.append(np.arange(b0, b0 + k))
+        a0, b0 = a0 + k, b0 + k
+
+        k = common_prefix(a[a0:a1][::-1], b[b0:b1][::-1])
+        ia.append(np.arange(a1 - k, a1))
+        ib.append(np.arange(b1 - k, b1))
+        a1, b1 = a1 - k, b1 - k
+
+        if a0 == a1 or b0 == b1:
+            continue
+
+        for k in ANCHOR_LENGTHS:
+            pa, pb = unique_anchors(a[a0:a1], b[b0:b1], k)
+            if len(pa):
+                break
+
+        if not len(pa):
+            if (a1 - a0) * (b1 - b0) <= DIFFLIB_LIMIT:
+                matcher = difflib.SequenceMatcher(None, a[a0:a1].tolist(), b[b0:b1].tolist(), autojunk=False)
+                for i, j, size in matcher.get_matching_blocks():
+                    ia.append(np.arange(a0 + i, a0 + i + size))
+                    ib.append(np.arange(b0 + j, b0 + j + size))
+            continue
+
+        # Keep the anchors in order on both sides, longer anchors must not overlap the previous one
+        anchors = []
+        for i in longest_increasing(pb.tolist()):
+            x, y = int(pa[i]) + a0, int(pb[i]) + b0
+            if not anchors or (x >= anchors[-1][0] + k and y >= anchors[-1][1] + k):
+                anchors.append((x, y))
+
+        for x, y in anchors:
+            ia.append(np.arange(x, x + k))
+            ib.append(np.arange(y, y + k))
+
+        # The gaps between consecutive anchors are aligned on their own
+        s_a, s_b = a0, b0
+        for x, y in anchors + [(a1, b1)]:
+            if s_a < x and s_b < y:
+                stack.append((s_a, x, s_b, y))
+            s_a, s_b = x + k, y + k
+
+    ia = np.concatenate(ia).astype(np.int64)
+    ib = np.concatenate(ib).astype(np.int64)
+    order = np.argsort(ia)
+
+    return ia[order], ib[order]
+
+
+def windows(ids, n):
+    if len(ids) < n:
+        return np.empty((0, n), dtype=np.int64)
+    return sliding_window_view(ids, n)
+
+
+def covered(starts, n, size):
+    """Returns a mask of the tokens covered by the n-token windows that start at starts."""
+    counts = np.zeros(size + 1, dtype=np.int64)
+    np.add.at(counts, starts, 1)
+    np.add.at(counts, starts + n, -1)
+    return np.cumsum(counts[:-1]) > 0
+
+
+def runs(status):
+    """Returns (start, end, status) of the runs of equal status."""
+    change = np.flatnonzero(np.diff(status)) + 1
+    starts = np.concatenate([[0], change]).astype(np.int64)
+    ends = np.concatenate([change, [len(status)]]).astype(np.int64)
+    return zip(starts.tolist(), ends.tolist(), status[starts].tolist())
+
+
+class DocumentEval:
+    """
+    Collects the pdftotext and reconstructed tokens of all pages of a document,
+    then aligns both streams in one pass and reports spans and metrics with their pages.
+    """
+
+    def __init__(self, n=4):
+        self.n = n
+        self.vocabulary = Vocabulary()
+
+        self._ptt = ([], [])
+        self._ddt = ([], [])
+
+        self.ptt_ids = self.ptt_pages = self.ptt_status = None
+        self.ddt_ids = self.ddt_pages = self.ddt_status = None
+
+    def add_tokens(self, page_number, ptt_text, ddt_text):
+        for (ids, pages), text in [(self._ptt, ptt_text), (self._ddt, ddt_text)]:
+            words, _, _ = PageEval.tokenize(text, False)
+            ids.append(self.vocabulary.intern(words))
+            pages.append(np.full(len(words), page_number, dtype=np.int64))
+
+    def add_page(self, page):
+        """Adds the pdftotext text and the header and markdown of a page, pages are added in order."""
+        text = get_text(page.doc.location).page(page.p)
+        self.add_tokens(page.p, text, "\n".join([page.header or "", page.md or ""]))
+
+    def align(self):
+        self.ptt_ids, self.ptt_pages = (np.concatenate(c) if c else np.empty(0, dtype=np.int64) for c in self._ptt)
+        self.ddt_ids, self.ddt_pages = (np.concatenate(c) if c else np.empty(0, dtype=np.int64) for c in self._ddt)
+
+        ia, ib = align(self.ptt_ids, self.ddt_ids)
+
+        ptt_matched = np.zeros(len(self.ptt_ids), dtype=bool)
+        ddt_matched = np.zeros(len(self.ddt_ids), dtype=bool)
+        ptt_matched[ia] = True
+        ddt_matched[ib] = True
+
+        self.ptt_status = np.where(ptt_matched, MATCHED, MISSING).astype(np.int8)
+        self.ddt_status = np.where(ddt_matched, MATCHED, EXTRA).astype(np.int8)
+
+        # Left over text is compared as n-grams, so single common words do not count as moved text
+        n = self.n
+        ptt_windows, ddt_windows = windows(self.ptt_ids, n), windows(self.ddt_ids, n)
+        if not len(ptt_windows) or not len(ddt_windows):
+            return self
+
+        ptt_keys, ddt_keys = window_keys(ptt_windows, ddt_windows, len(self.vocabulary))
+
+        ptt_unmatched = windows(~ptt_matched, n).all(axis=1)
+        ptt_aligned = windows(ptt_matched, n).all(axis=1)
+        ddt_unmatched = windows(~ddt_matched, n).all(axis=1)
+
+        # Text on both sides outside the alignment has moved
+        moved = ptt_unmatched & np.isin(ptt_keys, ddt_keys[ddt_unmatched])
+        self.ptt_status[covered(np.flatnonzero(moved), n, len(self.ptt_ids)) & ~ptt_matched] = REORDERED
+
+        duplicated = ddt_unmatched & np.isin(ddt_keys, ptt_keys[ptt_aligned])
+        self.ddt_status[covered(np.flatnonzero(duplicated), n, len(self.ddt_ids))] = DUPLICATED
+
+        moved = ddt_unmatched & np.isin(ddt_keys, ptt_keys[ptt_unmatched])
+        self.ddt_status[covered(np.flatnonzero(moved), n, len(self.ddt_ids))] = REORDERED
+
+        self.ddt_status[ddt_matched] = MATCHED
+
+        return self
+
+    def spans(self):
+        """Returns every missing, reordered, duplicated and extra span with its pages and text."""
+        spans = []
+
+        for stream, ids, pages, status in [("pdftotext", self.ptt_ids, self.ptt_pages, self.ptt_status),
+                                           ("reconstruction", self.ddt_ids, self.ddt_pages, self.ddt_status)]:
+            if not len(ids):
+                continue
+
+            for start, end, kind in runs(status):
+                if kind == MATCHED:
+                    continue
+                spans.append({'stream': stream,
+                              'kind': KINDS[kind],
+                              'start': start,
+                              'end': end,
+                              'tokens': end - start,
+                              'first_page': int(pages[start]),
+                              'last_page': int(pages[end - 1]),
+                              'text': " ".join(self.vocabulary.words[i] for i in ids[start:end].tolist())})
+
+        return spans
+
+    def page_metrics(self):
+        """Returns one row per page: its pdftotext tokens by status and its reconstructed tokens by status."""
+        last = int(max(self.ptt_pages.max(initial=0), self.ddt_pages.max(initial=0)))
+
+        def count(pages, mask):
+            return np.bincount(pages[mask], minlength=last + 1)
+
+        columns = {'tokens': count(self.ptt_pages, np.ones(len(self.ptt_pages), dtype=bool)),
+                   'matched': count(self.ptt_pages, self.ptt_status == MATCHED),
+                   'missing': count(self.ptt_pages, self.ptt_status == MISSING),
+                   'reordered': count(self.ptt_pages, self.ptt_status == REORDERED),
+                   'reconstructed_tokens': count(self.ddt_pages, np.ones(len(self.ddt_pages), dtype=bool)),
+                   'duplicated': count(self.ddt_pages, self.ddt_status == DUPLICATED),
+                   'extra': count(self.ddt_pages, self.ddt_status == EXTRA)}
+
+        pages = sorted(set(self.ptt_pages.tolist()) | set(self.ddt_pages.tolist()))
+        rows = []
+        for p in pages:
+            row = {'page': p, **{name: int(column[p]) for name, column in columns.items()}}
+            row['recall'] = row['matched'] / row['tokens'] if row['tokens'] else 1.0
+            rows.append(row)
+
+        return rows
+
+    def metrics(self):
+        """Returns the totals of the document, recall counts only tokens aligned in order."""
+        tokens = len(self.ptt_ids)
+        matched = int(np.count_nonzero(self.ptt_status == MATCHED))
+
+        return {'tokens': tokens,
+                'matched': matched,
+                'missing': int(np.count_nonzero(self.ptt_status == MISSING)),
+                'reordered': int(np.count_nonzero(self.ptt_status == REORDERED)),
+                'reconstructed_tokens': len(self.ddt_ids),
+                'duplicated': int(np.count_nonzero(self.ddt_status == DUPLICATED)),
+                'extra': int(np.count_nonzero(self.ddt_status == EXTRA)),
+                'recall': matched / tokens if tokens else 1.0}
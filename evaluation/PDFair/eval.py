@@ -1,8 +1,8 @@
-from subprocess import run, PIPE
 import spacy
 import re
-import os
-from time import sleep
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from PDFair.text import get_text
 
 nlp = spacy.load("nl_core_news_sm")
 banned_tokens = {"©", "\uf0b7", '•', '\u2022'}
@@ -22,25 +22,110 @@ class PttToken:
         return f"{self.text} (l{self.line}:i{self.index}) - missing {self.missing} times."
 
 
+class Vocabulary:
+    """Interns token texts to integer IDs, shared by the token streams of one page."""
+
+    def __init__(self):
+        self.ids = {}
+        self.words = []
+
+    def __len__(self):
+        return len(self.words)
+
+    def intern(self, words):
+        ids = np.empty(len(words), dtype=np.int64)
+
+        for i, word in enumerate(words):
+            token_id = self.ids.get(word)
+            if token_id is None:
+                token_id = self.ids[word] = len(self.words)
+                self.words.append(word)
+            ids[i] = token_id
+
+        return ids
+
+
+def window_keys(a, b, vocabulary_size):
+    """Returns one integer key per n-gram window of two (windows, n) ID arrays, equal windows get equal keys.
+    The IDs of a window are packed into one uint64 when the vocabulary fits in 64 // n bits,
+    otherwise the windows of both arrays are numbered together with np.unique, both are exact."""
+    n = a.shape[1]
+    bits = 64 // n
+
+    if vocabulary_size <= 1 << bits:
+        shifts = np.arange(n - 1, -1, -1, dtype=np.uint64) * np.uint64(bits)
+        return [np.bitwise_or.reduce(w.astype(np.uint64) << shifts, axis=1) for w in (a, b)]
+
+    _, inverse = np.unique(np.concatenate([a, b]), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    return inverse[:len(a)], inverse[len(a):]
+
+
+def border_flags(line, n=4):
+    """Returns the border flag of every token from the line numbers of the stream.
+    A token next to an empty line (a gap of more than one line) gets 1, a token within n-2 tokens
+    of such a token gets 2. The windows are counted with a prefix sum, so this is linear in the tokens."""
+    line = np.asarray(line)
+    border = np.zeros(len(line), dtype=np.int8)
+    if len(line) == 0:
+        return border
+
+    gap = np.diff(line) > 1
+    border[:-1][gap] = 1
+    border[1:][gap] = 1
+
+    radius = n - 2
+    if radius > 0:
+        ends = np.concatenate([[0], np.cumsum(border == 1)])
+        i = np.arange(len(line))
+        near = ends[np.minimum(i + radius, len(line) - 1) + 1] - ends[np.maximum(i - radius, 0)]
+        border[(border == 0) & (near > 0)] = 2
+
+    return border
+
+
 class Ngrams:
-    def __init__(self, tokens, ngrams):
-        self.tokens = tokens
-        self.ngrams = ngrams
+    """
+    Token stream of one text as arrays: the interned token IDs with their line and index, and per token
+    how often it is part of a missing n-gram and whether it lies next to a text block border (1) or within n-2 tokens of one (2).
+    """
+
+    def __init__(self, ids, vocabulary, n, line=None, index=None):
+        self.ids = ids
+        self.vocabulary = vocabulary
+        self.n = n
+
+        self.line = np.full(len(ids), -1, dtype=np.int64) if line is None else line
+        self.index = np.full(len(ids), -1, dtype=np.int64) if index is None else index
+
+        self.border = np.zeros(len(ids), dtype=np.int8)
+        self.missing = np.zeros(len(ids), dtype=np.int64)
+        self.ngram_count = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def windows(self):
+        """Returns the n-gram windows as a (windows, n) view on the token IDs."""
+        if len(self.ids) < self.n:
+            return np.empty((0, self.n), dtype=np.int64)
+        return sliding_window_view(self.ids, self.n)
+
+    @property
+    def tokens(self):
+        """The stream as PttToken objects, for the visualization and the notebooks."""
+        tokens = []
+        for token_id, line, index, border, missing in zip(self.ids.tolist(), self.line.tolist(), self.index.tolist(),
+                                                          self.border.tolist(), self.missing.tolist()):
+            token = PttToken(self.vocabulary.words[token_id], line, index)
+            token.border = border
+            token.missing = missing
+            tokens.append(token)
+
+        return tokens
 
     def ptttoken_border(self, n=4):
-        for i in range(len(self.tokens)):
-            if i != len(self.tokens) - 1 and (self.tokens[i + 1].line - self.tokens[i].line) > 1:
-                self.tokens[i].border = 1
-            if i != 0 and (self.tokens[i].line - self.tokens[i - 1].line) > 1:
-                self.tokens[i].border = 1
-
-        for i in range(len(self.tokens)):
-            if self.tokens[i].border: 
-                continue
-            if any(True if t.border == 1 else False for t in self.tokens[i:i + n - 1]):
-                self.tokens[i].border = 2
-            if any(True if t.border == 1 else False for t in self.tokens[max(0, i - n + 2):i]):
-                self.tokens[i].border = 2
+        self.border = border_flags(self.line, n)
 
 
 class PageEval:
@@ -49,50 +134,70 @@ class PageEval:
         self.txt = None
         self.ptt = None
         self.ddt = None
+        self.missing_ngrams = None
+        self.vocabulary = Vocabulary()
 
     def pdf2txt(self):
-        command = ['pdftotext', self.page.doc.location, 'out.txt',  '-nopgbrk', '-f', f'{self.page.p}', '-l', f'{self.page.p}']
-
-        result = -1
-
-        for i in range(10):
-            if result == 0: break
-            try:
-                result = run(command)
-            except:
-                print(f'{command} failed')
-
-        with open('out.txt', 'r') as file:
-            self.txt = file.read()
-
-        os.remove('out.txt')
+        # The whole document is extracted once and shared by the PageEval of every page
+        self.txt = get_text(self.page.doc.location).page(self.page.p)
 
     @staticmethod
     def tokenize(text, position):
+        """Returns the lower case words of a text, with the line and index of every word if position is set."""
         if position: 
-            return [PttToken(t.lower(), l, i) for l, s in enumerate(re.split('\n', text)) for i, t in enumerate(re.findall('(\w+)', s))]
-        return [PttToken(t.lower(), -1, -1) for t in re.findall('(\w+)', text)]
+            words, lines, indices = [], [], []
+            for l, s in enumerate(re.split('\n', text)):
+                found = re.findall('(\w+)', s)
+                words.extend(t.lower() for t in found)
+                lines.extend([l] * len(found))
+                indices.extend(range(len(found)))
+            return words, np.array(lines, dtype=np.int64), np.array(indices, dtype=np.int64)
+        return [t.lower() for t in re.findall('(\w+)', text)], None, None
 
     def ddt_ngrams(self, n=4):
-        tokens = self.tokenize(self.page.header + self.page.md, False)
+        words, _, _ = self.tokenize(self.page.header + self.page.md, False)
 
-        self.ddt = Ngrams(tokens,
-                        {" ".join(t.text for t in tokens[i:i+n]) for i in range(len(tokens) - n + 1)})
+        self.ddt = Ngrams(self.vocabulary.intern(words), self.vocabulary, n)
 
     def ptt_ngrams(self, n=4):
         if not self.txt: raise Exception("Page has no generated text attribute. Use self.pdf2text() first.")
 
-        tokens = self.tokenize(self.txt, True)
+        words, lines, indices = self.tokenize(self.txt, True)
 
-        self.ptt = Ngrams(tokens,
-                          {" ".join(t.text for t in tokens[i:i+n]) : tokens[i:i+n] for i in range(len(tokens) - n + 1)})
+        self.ptt = Ngrams(self.vocabulary.intern(words), self.vocabulary, n, lines, indices)
 
     def compare_ngrams(self):
-        missing = [ngram for ngram in list(self.ptt.ngrams.keys()) if not ngram in self.ddt.ngrams]
-
-        for ngram in missing:
-            for token in self.ptt.ngrams[ngram]:
-                token.missing += 1
+        ptt_keys, ddt_keys = window_keys(self.ptt.windows(), self.ddt.windows(), len(self.vocabulary))
+
+        # Every distinct n-gram counts once, the tokens of its last occurrence are marked missing
+        distinct, first_reversed = np.unique(ptt_keys[::-1], return_index=True)
+        last = len(ptt_keys) - 1 - first_reversed
+        starts = last[~np.isin(distinct, ddt_keys)]
+
+        self.ptt.ngram_count = len(distinct)
+        self.missing_ngrams = len(starts)
+
+        # Each missing n-gram adds one to its n tokens, as a difference array
+        counts = np.zeros(len(self.ptt) + 1, dtype=np.int64)
+        counts[starts] += 1
+        counts[starts + self.ptt.n] -= 1
+        self.ptt.missing = np.cumsum(counts[:-1])
+
+    def metrics(self, n=4):
+        """Returns the evaluation results of the page as a flat dict, one row of the results table."""
+        row = {'tokens': len(self.ptt),
+               'ngrams': self.ptt.ngram_count,
+               'missing_ngrams': self.missing_ngrams,
+               'recall': 1 - self.missing_ngrams / self.ptt.ngram_count if self.ptt.ngram_count else 1.0}
+
+        # Number of tokens missing i times, split by whether they lie near a text block border
+        border = self.ptt.border > 0
+        for i in range(1, n + 1):
+            missing = self.ptt.missing == i
+            row[f'missing{i}_border'] = int(np.count_nonzero(border & missing))
+            row[f'missing{i}_non_border'] = int(np.count_nonzero(~border & missing))
+
+        return row
 
     def visualize(self):
         raise NotImplementedError(f"{self.__class__.__name__} must implement `visualize()`")
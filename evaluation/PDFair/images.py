@@ -0,0 +1,46 @@
+import numpy as np
+from pdf2image import convert_from_path
+
+# Resolution of pages rendered here, matching what the YOLO header model was trained on
+DPI = 200
+
+# Pages rendered per pdftoppm call while streaming pages, bounds the bitmaps held ahead of the
+# current page (about 12 MB per A4 page at 200 dpi) while a document is still rasterized in few calls
+STREAM_CHUNK = 8
+
+
+class PageImages:
+    """
+    Keeps one bitmap per page of a PDF, so the page is rasterized once and every
+    consumer (DeepDoctection, YOLO header detection) works on the same buffer.
+    """
+
+    def __init__(self, path, dpi=DPI, chunk=None):
+        self.path = path
+        self.dpi = dpi
+        self.chunk = chunk  # pages rendered per pdftoppm call on a miss, None renders the rest of the document
+        self.images = {}
+
+    def add(self, page_number, image, bgr=False):
+        """Registers a page image that was already rendered, e.g. the one DeepDoctection analyzed."""
+        if image is not None:
+            self.images[page_number] = (image, bgr)
+
+    def render(self, first_page, last_page=None):
+        """Rasterizes all missing pages from first_page on with a single pdftoppm call."""
+        pages = convert_from_path(self.path, dpi=self.dpi, first_page=first_page, last_page=last_page)
+
+        for page_number, image in enumerate(pages, first_page):
+            if page_number not in self.images:
+                self.images[page_number] = (np.array(image), False)
+
+    def get(self, page_number):
+        """Returns the (image, bgr) pair of a page, rendering the following pages too on a miss."""
+        if page_number not in self.images:
+            self.render(page_number, page_number + self.chunk - 1 if self.chunk else None)
+
+        return self.images[page_number]
+
+    def release(self, page_number):
+        """Drops the bitmap of a page once all consumers are done with it."""
+        self.images.pop(page_number, None)
@@ -0,0 +1,47 @@
+from subprocess import run, PIPE, CalledProcessError
+from functools import lru_cache
+import os
+
+
+class PdfText:
+    """Text layer of a whole PDF, extracted with one pdftotext call and split on its page breaks."""
+
+    def __init__(self, path, retries=3):
+        command = ['pdftotext', str(path), '-']
+
+        for i in range(retries):
+            try:
+                result = run(command, stdout=PIPE, check=True)
+                break
+            except CalledProcessError:
+                print(f'{command} failed')
+        else:
+            raise RuntimeError(f'{command} failed {retries} times')
+
+        # pdftotext ends every page with a form feed, which leaves an empty item after the last page
+        self.pages = result.stdout.decode('utf-8').split('\f')
+        if self.pages and self.pages[-1] == '':
+            self.pages.pop()
+        self._lines = {}
+
+    def __len__(self):
+        return len(self.pages)
+
+    def page(self, page_number):
+        return self.pages[page_number - 1]
+
+    def lines(self, page_number):
+        if page_number not in self._lines:
+            self._lines[page_number] = self.page(page_number).split('\n')
+        return self._lines[page_number]
+
+
+@lru_cache(maxsize=16)
+def _load(path, mtime):
+    return PdfText(path)
+
+
+def get_text(path):
+    """Returns the extracted text of a PDF, parsing every document only once per process."""
+    path = os.path.abspath(path)
+    return _load(path, os.path.getmtime(path))
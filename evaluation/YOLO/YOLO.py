@@ -1,4 +1,6 @@
+import os
 import cv2
+import threading
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
@@ -11,6 +13,92 @@ from pdf2image import convert_from_path
 
 # import matplotlib.image
 
+# The model path can be overridden with an environment variable, by default the model next to this file is used
+MODEL_PATH = os.environ.get("PDFAIR_YOLO_MODEL",
+                            os.path.join(os.path.dirname(os.path.abspath(__file__)), "trained_models", "onnx", "model.onnx"))
+
+class HeaderDetector:
+    """
+    Wrapper around the ONNX Runtime session of the YOLO header model. The session is only created
+    on first use, so importing this module stays cheap. ONNX Runtime sessions can be run from several
+    threads at once, the lock only guards the lazy creation.
+
+    The thread counts are passed on to the SessionOptions (0 lets ONNX Runtime decide), so worker
+    processes can divide the cores between concurrent documents. With optimized_model_path set, the
+    optimized graph is written there on the first run and loaded directly on the next runs.
+    """
+    def __init__(self, model_path: str = None, intra_op_num_threads: int = 0, inter_op_num_threads: int = 0,
+                 graph_optimization_level=ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+                 optimized_model_path: str = None, providers=('CPUExecutionProvider',)):
+        self.model_path = model_path or MODEL_PATH
+        self.intra_op_num_threads = intra_op_num_threads
+        self.inter_op_num_threads = inter_op_num_threads
+        self.graph_optimization_level = graph_optimization_level
+        self.optimized_model_path = optimized_model_path
+        self.providers = list(providers)
+
+        self.input_name = None
+        self.output_names = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> ort.InferenceSession:
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+
+    def _create_session(self) -> ort.InferenceSession:
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.intra_op_num_threads
+        options.inter_op_num_threads = self.inter_op_num_threads
+        options.graph_optimization_level = self.graph_optimization_level
+
+        model_path = self.model_path
+        if self.optimized_model_path:
+            if os.path.exists(self.optimized_model_path):
+                # The cached graph is already optimized, so skip the optimization passes
+                model_path = self.optimized_model_path
+                options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            else:
+                options.optimized_model_filepath = self.optimized_model_path
+
+        session = ort.InferenceSession(model_path, sess_options=options, providers=self.providers)
+
+        # Get the correct names of the input and output variables from the model
+        self.input_name = session.get_inputs()[0].name
+        self.output_names = [o.name for o in session.get_outputs()]
+
+        return session
+
+    def has_dynamic_batch(self) -> bool:
+        """Returns whether the loaded model accepts more than one image per session call."""
+        return not isinstance(self.session.get_inputs()[0].shape[0], int)
+
+    def run(self, image_input: np.ndarray) -> np.ndarray:
+        """Runs the model on a (N, 3, H, W) float32 tensor and returns the raw detections."""
+        session = self.session
+        return session.run(self.output_names, {self.input_name: image_input})[0]
+
+_detector = None
+_detector_lock = threading.Lock()
+
+def get_detector() -> HeaderDetector:
+    """Returns the process-wide default detector, which is created on first use."""
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                _detector = HeaderDetector()
+    return _detector
+
+def set_detector(detector: HeaderDetector) -> None:
+    """Replaces the process-wide default detector, e.g. with one tuned for the number of worker processes."""
+    global _detector
+    _detector = detector
+
 def load_and_process_pdf(path_to_pdf_file: str, page: int = None) -> List[np.ndarray] :
     """
     This function takes as input the path to a PDF file, and returns a list of numpy 
@@ -68,7 +156,7 @@ def scale_boxes(boxes: np.ndarray, original_shape: Tuple[int], ratio: float, pad
     
     return boxes
 
-def predict(image: np.ndarray) -> np.ndarray:
+def predict(image: np.ndarray, detector: HeaderDetector = None) -> np.ndarray:
     """
     Function that, given a pre-processed (padded) image runs the YOLO model on that image
     and return the (uncorrected) bounding boxes. Note that this function does not return just 
@@ -79,15 +167,54 @@ def predict(image: np.ndarray) -> np.ndarray:
     image_input = image.astype(np.float32) / 255.0
     image_input = np.transpose(image_input, (2, 0, 1))[None]  # (1, 3, H, W)
     
-    outputs = session.run(output_names, {input_name: image_input})
+    detector = detector or get_detector()
+    outputs = detector.run(image_input)
     
-    raw_detections = outputs[0][0] # note that detections are in the (x1,y1, x2, y2) format for bounding boxes
+    raw_detections = outputs[0] # note that detections are in the (x1,y1, x2, y2) format for bounding boxes
     
     # We want to remove rows which are all zeros
     detections = raw_detections[~np.all(raw_detections == 0, axis=1)]
     
     return detections
 
+def letterbox_batch(images: List[np.ndarray], img_size=(640, 640), bgr=False):
+    """
+    Function that letterboxes a list of page images into one contiguous (N, 3, H, W) float32 tensor,
+    and returns the tensor together with the ratio and padding of every image.
+    The bgr flag is either one bool for all images or a list with a bool per image.
+    """
+    batch = np.empty((len(images), 3, img_size[0], img_size[1]), dtype=np.float32)
+    ratios, pads = [], []
+    flags = bgr if isinstance(bgr, (list, tuple)) else [bgr] * len(images)
+
+    for i, (image, flag) in enumerate(zip(images, flags)):
+        padded_image, ratio, pad = letterbox_padding(image, new_shape=img_size)
+        if flag:
+            padded_image = padded_image[:, :, ::-1]
+        batch[i] = np.transpose(padded_image, (2, 0, 1))
+        ratios.append(ratio)
+        pads.append(pad)
+
+    batch /= 255.0
+
+    return batch, ratios, pads
+
+def predict_batch(batch: np.ndarray, detector: HeaderDetector = None) -> List[np.ndarray]:
+    """
+    Function that runs the YOLO model on a letterboxed (N, 3, H, W) batch with a single session call,
+    and returns the (uncorrected) detections per image. Models exported with a static batch size of 1
+    fall back to one session call per image.
+    """
+    detector = detector or get_detector()
+
+    if detector.has_dynamic_batch():
+        raw_detections = detector.run(batch)
+    else:
+        raw_detections = np.concatenate([detector.run(batch[i:i+1]) for i in range(len(batch))])
+
+    # We want to remove rows which are all zeros
+    return [detections[~np.all(detections == 0, axis=1)] for detections in raw_detections]
+
 def box_iou(box1: np.ndarray, box2: np.ndarray) -> float:
     """Compute IoU between box1 (N, 4) and box2 (M, 4)"""
     area1 = (box1[:, 2] - box1[:, 0]) * (box1[:, 3] - box1[:, 1])
@@ -126,28 +253,92 @@ def remove_overlapping_boxes(boxes: np.ndarray) -> np.ndarray:
 
     return np.stack(keep) if keep else np.zeros((0, 6))
 
-def run_onnx_inference(image: np.ndarray, img_size=(640, 640), conf_thres: float=0.25):
+# Above this many boxes the N x N IoU matrix of non_max_suppression costs more than it saves
+NMS_MATRIX_MAX = 300
+
+def non_max_suppression(boxes: np.ndarray, iou_thres: float=0.0, class_aware: bool=False) -> np.ndarray:
+    """
+    Greedy suppression like remove_overlapping_boxes, with an IoU threshold and optionally per class.
+    The boxes are walked in order of confidence and every kept box suppresses the lower confidence boxes
+    it overlaps by more than iou_thres, so this keeps exactly the boxes of the greedy loop, also on equal
+    confidences. The walk is a Python loop over the kept boxes, only the IoU is computed with NumPy: up to
+    NMS_MATRIX_MAX boxes for all pairs in one call, above that one row per kept box.
+    With iou_thres=0 any overlap suppresses, like remove_overlapping_boxes. With class_aware only boxes
+    of the same class suppress each other.
+    """
+    if len(boxes) == 0:
+        return boxes
+
+    boxes = boxes[np.argsort(-boxes[:, 4])]  # sort by confidence descending
+
+    # overlap[i, j] is True when the higher confidence box i suppresses box j
+    matrix = len(boxes) <= NMS_MATRIX_MAX
+    if matrix:
+        overlap = box_iou(boxes[:, :4], boxes[:, :4]) > iou_thres
+        if class_aware:
+            overlap &= boxes[:, None, 5] == boxes[None, :, 5]
+
+    keep = np.ones(len(boxes), dtype=bool)
+    for i in range(len(boxes) - 1):
+        if not keep[i]:
+            continue
+        if matrix:
+            row = overlap[i, i+1:]
+        else:
+            row = box_iou(boxes[i:i+1, :4], boxes[i+1:, :4])[0] > iou_thres
+            if class_aware:
+                row &= boxes[i+1:, 5] == boxes[i, 5]
+        keep[i+1:] &= ~row
+
+    return boxes[keep]
+
+def run_onnx_inference(image: np.ndarray, img_size=(640, 640), conf_thres: float=0.25, bgr: bool=False,
+                       detector: HeaderDetector = None, iou_thres: float=0.0):
     """
     Function that combines all of the above steps, and predicts headers for an input image array.
-    The output is simply a N by 4 array with the bounding box coordinates
+    The output is simply a N by 4 array with the bounding box coordinates.
+    Set bgr for images in BGR channel order (e.g. DeepDoctection page images), the model expects RGB.
     """
     
     original_image_shape = image.shape[:2] # original image has the number of channels last
 
     # Letterbox padding
     padded_image, ratio, pad = letterbox_padding(image, new_shape=img_size)
+    if bgr:
+        padded_image = padded_image[:, :, ::-1] # flip channels on the small padded image instead of the full page
 
     # run model inference
-    boxes = predict(padded_image)
+    boxes = predict(padded_image, detector)
     
     # Filter and rescale boxes
     boxes = boxes[boxes[:, 4] >= conf_thres]
     boxes = scale_boxes(boxes.copy(), original_image_shape, ratio, pad)
     
-    filtered_boxes = remove_overlapping_boxes(boxes)[:, :4] # remove the last two columns, and just give the bounding boxes
+    filtered_boxes = non_max_suppression(boxes, iou_thres)[:, :4] # remove the last two columns, and just give the bounding boxes
 
     return filtered_boxes
 
+def run_onnx_inference_batch(images: List[np.ndarray], img_size=(640, 640), conf_thres: float=0.25,
+                             bgr=False, batch_size: int=16, detector: HeaderDetector = None,
+                             iou_thres: float=0.0) -> List[np.ndarray]:
+    """
+    Batched version of run_onnx_inference, which predicts headers for all images of one or more documents.
+    Images are sent to the model batch_size at a time, and the output is one N by 4 array per image.
+    """
+    results = []
+    flags = bgr if isinstance(bgr, (list, tuple)) else [bgr] * len(images)
+
+    for start in range(0, len(images), batch_size):
+        chunk = images[start:start + batch_size]
+        batch, ratios, pads = letterbox_batch(chunk, img_size=img_size, bgr=flags[start:start + batch_size])
+
+        for image, boxes, ratio, pad in zip(chunk, predict_batch(batch, detector), ratios, pads):
+            boxes = boxes[boxes[:, 4] >= conf_thres]
+            boxes = scale_boxes(boxes.copy(), image.shape[:2], ratio, pad)
+            results.append(non_max_suppression(boxes, iou_thres)[:, :4])
+
+    return results
+
 def visualize_boxes(image: np.ndarray, boxes: np.ndarray)-> None:
     plot_image = image.copy()
     for box in boxes:
@@ -158,12 +349,6 @@ def visualize_boxes(image: np.ndarray, boxes: np.ndarray)-> None:
 # example_images = load_and_process_pdf('../BeslisnotaPDFs/nl.mnre1010.2e-b.2024.1.doc.1.pdf')
 # Image.fromarray(example_images[0])
 
-# Load the model using the onnx runtime
-session = ort.InferenceSession('/mnt/c/Users/Martijn/Documents/GitHub/PDFair/evaluation/YOLO/trained_models/onnx/model.onnx', providers=['CPUExecutionProvider'])
-# Get the correct names of the input and output variables from the model
-input_name = session.get_inputs()[0].name
-output_names = [o.name for o in session.get_outputs()]
-
 # output_boxes = run_onnx_inference(example_images[0])
 # image = visualize_boxes(example_images[0], output_boxes)
 # print(output_boxes)
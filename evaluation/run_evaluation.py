@@ -0,0 +1,249 @@
+"""
+Evaluates every page of every document in the corpus with PDFair and PageEval,
+spread over a pool of worker processes.
+
+Every document is written as its own Parquet part in <output>/parts, so an interrupted
+run resumes by skipping the documents that already have a part. At the end all parts
+are combined into <output>/results.parquet and a summary is printed.
+
+With --document the pdftotext text of the whole document is aligned against the reconstructed text
+instead of comparing n-gram sets per page, the spans that are missing, reordered, duplicated or
+extra are written to <output>/spans.
+
+    python run_evaluation.py -i BeslisnotaPDFs -o results -w 4
+    python run_evaluation.py -i Beslisnotas2024.csv --pdf-dir BeslisnotaPDFs -o results
+    python run_evaluation.py -i BeslisnotaPDFs -o results-aligned --document
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import PDFair.PDFair
+import PDFair.eval
+import PDFair.align
+from YOLO.YOLO import HeaderDetector, set_detector
+from analyzer import get_analyzer, born_digital_config, default_workers  # on the path once PDFair.PDFair is imported
+import manifest
+import tracing
+
+
+def argumentParse():
+    parser = argparse.ArgumentParser(description='Evaluates PDFair on a corpus of PDF documents.')
+
+    parser.add_argument('-i', '--input', type=str, default='BeslisnotaPDFs',
+                        help='Directory with pdf files, or a manifest: a CSV with an id column or a list of pdf paths.')
+    parser.add_argument('-o', '--output', type=str, default='results',
+                        help='Output directory for the results.')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='Number of worker processes, by default as many as fit in the available memory.')
+    parser.add_argument('-n', type=int, default=4,
+                        help='Size of the n-grams that are compared.')
+    parser.add_argument('--pdf-dir', type=str, default='BeslisnotaPDFs',
+                        help='Directory with the pdf files of a CSV manifest.')
+    parser.add_argument('--document', action='store_true', default=False,
+                        help='Align the text of whole documents instead of comparing n-grams per page.')
+    parser.add_argument('--summary', action='store_true', default=False,
+                        help='Only combine the existing parts and print the summary.')
+    parser.add_argument('--trace', type=str, default=None,
+                        help='Append the time, CPU time and peak memory of every stage to this JSON lines file.')
+    parser.add_argument('--chrome-trace', type=str, default=None,
+                        help='Append the stages as Chrome trace events to this file (chrome://tracing, Perfetto).')
+
+    return parser.parse_args()
+
+
+def part_path(output_dir, pdf_path, kind='parts'):
+    return os.path.join(output_dir, kind, os.path.basename(pdf_path)[:-len('.pdf')] + '.parquet')
+
+
+def write_parquet(rows, path, columns=None):
+    # Write next to the part first, so an interrupted write is never mistaken for a finished document
+    pd.DataFrame(rows, columns=columns).to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+
+def init_worker(workers):
+    """Loads the models once per worker and divides the cores between the workers."""
+    try:
+        set_detector(HeaderDetector(intra_op_num_threads=max(1, os.cpu_count() // workers)))
+        get_analyzer(born_digital_config(PDFair.PDFair.config_overwrite))
+    except Exception as e:
+        print(f'Error loading the models in worker {os.getpid()}: {type(e).__name__}: {str(e)}', file=sys.stderr, flush=True)
+        raise
+
+
+def evaluate_document(pdf_path, n=4):
+    """Evaluates all pages of one document and returns one result row per page.
+    Pages are streamed, so long documents do not hold every page in memory."""
+    pdf = PDFair.PDFair.Pdf(pdf_path)
+
+    rows = []
+    for page in pdf.iter_pages(skip_headers=True):
+        row = {'document': os.path.basename(pdf_path), 'page': page.p, 'error': None}
+
+        try:
+            with tracing.stage("evaluate", document=pdf_path, page=page.p):
+                evaluation = PDFair.eval.PageEval(page)
+                evaluation.pdf2txt()
+                evaluation.ddt_ngrams(n)
+                evaluation.ptt_ngrams(n)
+                evaluation.compare_ngrams()
+                evaluation.ptt.ptttoken_border(n)
+
+                row.update(evaluation.metrics(n))
+
+        except Exception as e:
+            row['error'] = f'{type(e).__name__}: {str(e)}'
+
+        rows.append(row)
+
+    return rows
+
+
+def align_document(pdf_path, n=4):
+    """Aligns the text of all pages of one document at once.
+    Returns one result row per page and the spans that were not aligned in order."""
+    pdf = PDFair.PDFair.Pdf(pdf_path)
+    evaluation = PDFair.align.DocumentEval(n)
+
+    for page in pdf.iter_pages(skip_headers=True):
+        with tracing.stage("pdftotext", document=pdf_path, page=page.p):
+            evaluation.add_page(page)
+
+    with tracing.stage("align", document=pdf_path):
+        evaluation.align()
+
+    document = os.path.basename(pdf_path)
+    rows = [{'document': document, **row, 'error': None} for row in evaluation.page_metrics()]
+    spans = [{'document': document, **span} for span in evaluation.spans()]
+
+    return rows, spans
+
+
+SPAN_COLUMNS = ['document', 'stream', 'kind', 'start', 'end', 'tokens', 'first_page', 'last_page', 'text']
+
+
+def process_job(job):
+    """Evaluates one document in a worker and writes its part, failures do not stop the run."""
+    pdf_path, output_dir, n, document = job
+    start = time.perf_counter()
+
+    try:
+        with tracing.stage("document", document=pdf_path) as span:
+            if document:
+                rows, spans = align_document(pdf_path, n)
+                # The spans go first, a document counts as done once its part exists
+                write_parquet(spans, part_path(output_dir, pdf_path, 'spans'), SPAN_COLUMNS)
+            else:
+                rows = evaluate_document(pdf_path, n)
+
+            write_parquet(rows, part_path(output_dir, pdf_path))
+            span['pages'] = len(rows)
+        error = None
+
+    except Exception as e:
+        rows = []
+        error = f'{type(e).__name__}: {str(e)}'
+
+    return pdf_path, len(rows), error, time.perf_counter() - start
+
+
+def run(input_paths, output_dir, workers, n=4, document=False):
+    """Evaluates all documents that have no part yet.
+    Exits when the workers cannot load the models. A worker that dies (e.g. killed for running
+    out of memory) breaks the pool, the documents not evaluated by then are reported as failed."""
+    os.makedirs(os.path.join(output_dir, 'parts'), exist_ok=True)
+    os.makedirs(os.path.join(output_dir, 'spans'), exist_ok=True)
+
+    todo = [path for path in input_paths if not os.path.exists(part_path(output_dir, path))]
+    print(f'{len(input_paths) - len(todo)} of {len(input_paths)} documents already evaluated, {len(todo)} to go')
+
+    jobs = [(path, output_dir, n, document) for path in todo]
+    workers = workers or default_workers()
+    failed = []
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(workers,)) as pool:
+        # Start one worker first, a failing initializer breaks the pool before any document is evaluated
+        try:
+            pool.submit(os.getpid).result()
+        except BrokenProcessPool:
+            sys.exit('Error: the worker processes could not load the models, see the error above')
+
+        futures = {pool.submit(process_job, job): job[0] for job in jobs}
+        broken = False
+
+        for i, future in enumerate(as_completed(futures), 1):
+            try:
+                pdf_path, pages, error, duration = future.result()
+            except BrokenProcessPool:
+                pdf_path, pages, error, duration = futures[future], 0, 'worker process died', 0.0
+                broken = True
+
+            if error is None:
+                print(f'[{i}/{len(jobs)}] {pdf_path}: {pages} pages in {duration:.1f}s')
+            else:
+                failed.append(f'{pdf_path}\t{error}')
+                print(f'[{i}/{len(jobs)}] {pdf_path} failed: {error}')
+
+    if broken:
+        print('A worker process died, e.g. killed for running out of memory. '
+              'Rerun with fewer workers (-w), evaluated documents are skipped', file=sys.stderr)
+
+    with open(os.path.join(output_dir, 'failed.txt'), 'w') as file:
+        file.write('\n'.join(failed))
+
+    print(f'Evaluated {len(jobs) - len(failed)}/{len(jobs)} documents in {time.perf_counter() - start:.1f}s')
+
+
+def summary(output_dir, n=4):
+    """Combines all parts into results.parquet and prints the totals per missing count."""
+    parts = sorted(glob.glob(os.path.join(output_dir, 'parts', '*.parquet')))
+    if not parts:
+        return print('No results yet')
+
+    results = pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True)
+    results.to_parquet(os.path.join(output_dir, 'results.parquet'), index=False)
+
+    evaluated = results[results['error'].isna()]
+
+    buffer = f'{results["document"].nunique()} documents, {len(results)} pages, {len(results) - len(evaluated)} pages failed\n'
+
+    # Results of --document have aligned token counts instead of n-gram counts
+    if 'matched' in results:
+        spans = [pd.read_parquet(part) for part in sorted(glob.glob(os.path.join(output_dir, 'spans', '*.parquet')))]
+        if spans:
+            pd.concat(spans, ignore_index=True).to_parquet(os.path.join(output_dir, 'spans.parquet'), index=False)
+
+        buffer += f'Aligned token recall: {evaluated["matched"].sum() / max(1, evaluated["tokens"].sum()):.4f}\n'
+        buffer += '   TOKENS | MISSING | REORDERED | DUPLICATED | EXTRA\n'
+        buffer += (f' {int(evaluated["tokens"].sum()):8d} | {int(evaluated["missing"].sum()):7d} | '
+                   f'{int(evaluated["reordered"].sum()):9d} | {int(evaluated["duplicated"].sum()):10d} | {int(evaluated["extra"].sum()):5d}\n')
+        return print(buffer)
+
+    buffer += f'Mean n-gram recall: {evaluated["recall"].mean():.4f}\n'
+    buffer += 'COUNT | BORDER | NON_BORDER\n'
+    for i in range(1, n+1):
+        buffer += f'   {i:2d} | {int(evaluated[f"missing{i}_border"].sum()):6d} | {int(evaluated[f"missing{i}_non_border"].sum()):10d}\n'
+
+    print(buffer)
+
+
+if __name__ == '__main__':
+    args = argumentParse()
+
+    # Worker processes inherit the trace files through the environment
+    if args.trace or args.chrome_trace:
+        tracing.enable(args.trace, args.chrome_trace)
+
+    if not args.summary:
+        run(manifest.collect_inputs(args.input, args.pdf_dir), args.output, args.workers, args.n, args.document)
+
+    summary(args.output, args.n)
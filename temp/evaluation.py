@@ -1,30 +1,183 @@
+import os
+import hashlib
+import struct
+
+import numpy as np
 from datasketch import MinHash, MinHashLSH
 
-def get_minhash(sentence, num_perm=256):
+NUM_PERM = 128
+
+# Same constants and permutations as the MinHash of datasketch 1.x (pinned in requirements.txt), so signatures
+# equal get_minhash. datasketch 2 defaults to another hashing scheme, only MinHash(scheme='legacy') matches there.
+_mersenne_prime = np.uint64((1 << 61) - 1)
+_max_hash = np.uint64((1 << 32) - 1)
+
+# Tokens per block of the signature computation, bounds the (tokens, num_perm) array to 64 MB at 128 perms
+CHUNK_TOKENS = 1 << 16
+
+# Query sentences per block of candidate pairs
+QUERY_BLOCK = 4096
+
+
+def npz_path(path):
+    """np.savez appends .npz to a path without it, so save and load use the same file name."""
+    path = os.fspath(path)
+    return path if path.endswith('.npz') else path + '.npz'
+
+
+def get_minhash(sentence, num_perm=NUM_PERM):
     """Generate a MinHash object for a given sentence."""
     m = MinHash(num_perm=num_perm)
     for word in sentence.split():
         m.update(word.encode('utf8'))  # Hash each word
     return m
 
-def minhash_match_sentences(sentences_a, sentences_b, threshold=0.7, num_perm=128):
+
+def permutations(num_perm, seed=1):
+    gen = np.random.RandomState(seed)
+    return np.array([(gen.randint(1, _mersenne_prime, dtype=np.uint64),
+                      gen.randint(0, _mersenne_prime, dtype=np.uint64)) for _ in range(num_perm)], dtype=np.uint64).T
+
+
+def word_hashes(words):
+    """32-bit SHA1 hash of every word, each distinct word is hashed once."""
+    unique, inverse = np.unique(np.array(words), return_inverse=True)
+    hashes = np.array([struct.unpack('<I', hashlib.sha1(w.encode('utf8')).digest()[:4])[0] for w in unique.tolist()],
+                      dtype=np.uint64)
+    return hashes[inverse.reshape(-1)]
+
+
+def signatures(sentences, num_perm=NUM_PERM, seed=1):
+    """MinHash signatures of all sentences as one (sentences, num_perm) array.
+    The permutations are applied to all words of a block of sentences at once.
+    Sentences without words keep the empty signature (all max hash)."""
+    words = [s.split() for s in sentences]
+    lengths = np.array([len(w) for w in words], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    result = np.full((len(sentences), num_perm), _max_hash, dtype=np.uint64)
+    if not offsets[-1]:
+        return result
+
+    hv = word_hashes([word for w in words for word in w])
+    a, b = permutations(num_perm, seed)
+
+    start = 0
+    while start < len(sentences):
+        # Whole sentences per block, at least one
+        stop = max(int(np.searchsorted(offsets, offsets[start] + CHUNK_TOKENS, side='right')) - 1, start + 1)
+        stop = min(stop, len(sentences))
+
+        block = hv[offsets[start]:offsets[stop]]
+        phv = np.bitwise_and((block[:, None] * a + b) % _mersenne_prime, _max_hash)
+
+        nonempty = np.flatnonzero(lengths[start:stop]) + start
+        if len(nonempty):
+            result[nonempty] = np.minimum.reduceat(phv, offsets[nonempty] - offsets[start], axis=0)
+
+        start = stop
+
+    return result
+
+
+def band_keys(signatures, b, r):
+    """One 64-bit key per band of every signature, shape (b, sentences)."""
+    bands = signatures[:, :b * r].reshape(len(signatures), b, r)
+
+    keys = np.full((len(signatures), b), 0xcbf29ce484222325, dtype=np.uint64)
+    for i in range(r):
+        keys = (keys ^ bands[:, :, i]) * np.uint64(0x100000001b3)
+
+    return keys.T
+
+
+class SentenceMatcher:
+    """
+    MinHash + LSH index over the reference sentences (e.g. the pdftotext sentences of the corpus).
+    The index is built once, saved with save() and loaded with load(), and answers any number of
+    query batches. Every query sentence is matched to the candidate with the highest estimated
+    Jaccard similarity, sentences without words are never indexed or matched.
+    """
+
+    def __init__(self, sentences=(), threshold=0.7, num_perm=NUM_PERM, seed=1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.seed = seed
+
+        # Band layout that datasketch picks for this threshold
+        lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+        self.b, self.r = lsh.b, lsh.r
+
+        self.index(signatures(list(sentences), num_perm, seed))
+
+    def index(self, reference):
+        self.reference = reference
+
+        # Per band the sorted keys of the sentences with words, with the sentence of every key
+        rows = np.flatnonzero((reference != _max_hash).any(axis=1))
+        keys = band_keys(reference[rows], self.b, self.r)
+        order = np.argsort(keys, axis=1, kind='stable')
+        self.keys = np.take_along_axis(keys, order, axis=1)
+        self.order = rows[order]
+
+    def save(self, path):
+        np.savez(npz_path(path), reference=self.reference, keys=self.keys, order=self.order,
+                 params=np.array([self.threshold, self.num_perm, self.seed, self.b, self.r], dtype=np.float64))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(npz_path(path))
+        threshold, num_perm, seed, b, r = data['params'].tolist()
+
+        matcher = cls.__new__(cls)
+        matcher.threshold, matcher.num_perm, matcher.seed = threshold, int(num_perm), int(seed)
+        matcher.b, matcher.r = int(b), int(r)
+        matcher.reference, matcher.keys, matcher.order = data['reference'], data['keys'], data['order']
+        return matcher
+
+    def candidates(self, queries):
+        """Returns the (query, reference) pairs that share at least one band."""
+        keys = band_keys(queries, self.b, self.r)
+        qi, ri = [], []
+
+        for band in range(self.b):
+            lo = np.searchsorted(self.keys[band], keys[band], side='left')
+            hi = np.searchsorted(self.keys[band], keys[band], side='right')
+            counts = hi - lo
+
+            q = np.repeat(np.arange(len(queries)), counts)
+            # Position of every pair within the run of equal keys
+            within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            qi.append(q)
+            ri.append(self.order[band][np.repeat(lo, counts) + within])
+
+        pairs = np.unique(np.stack([np.concatenate(qi), np.concatenate(ri)], axis=1), axis=0)
+        return pairs[:, 0], pairs[:, 1]
+
+    def match(self, sentences):
+        """Match a batch of sentences, returns {sentence index: reference index}."""
+        queries = signatures(list(sentences), self.num_perm, self.seed)
+        rows = np.flatnonzero((queries != _max_hash).any(axis=1))
+
+        matches = {}
+        # Blocks of queries bound the memory of the candidate pairs
+        for start in range(0, len(rows), QUERY_BLOCK):
+            block = rows[start:start + QUERY_BLOCK]
+            qi, ri = self.candidates(queries[block])
+            if not len(qi):
+                continue
+
+            # Best candidate per query, the lowest reference index on equal similarity
+            similarity = (queries[block][qi] == self.reference[ri]).mean(axis=1)
+            order = np.lexsort((ri, -similarity, qi))
+            qi, ri = qi[order], ri[order]
+            first = np.concatenate([[True], qi[1:] != qi[:-1]])
+
+            matches.update(zip(block[qi[first]].tolist(), ri[first].tolist()))
+
+        return matches
+
+
+def minhash_match_sentences(sentences_a, sentences_b, threshold=0.7, num_perm=NUM_PERM):
     """Match sentences using MinHash + Locality-Sensitive Hashing (LSH)."""
-    lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
-    
-    # Add all sentences from B to the LSH index
-    for i, sentence in enumerate(sentences_b):
-        m = get_minhash(sentence, num_perm)
-        lsh.insert(str(i), m)
-
-    matches = {}  # Store matched indices
-    for i, sentence in enumerate(sentences_a):
-        m_a = get_minhash(sentence, num_perm)
-        results = lsh.query(m_a)  # Find similar sentences in B
-        
-        print(results)
-
-        if results:
-            best_match_idx = int(results[0])  # Take the first match
-            matches[i] = best_match_idx
-    
-    return matches
+    return SentenceMatcher(sentences_b, threshold, num_perm).match(sentences_a)